@@ -1,36 +1,49 @@
-import librosa
-import os
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+import metrics
+import render
+from analysis_context import load_audio as load_shared_audio
+from envelope import minmax_envelope, pixel_columns
 
-def load_audio(file_path):
-    y, sr = librosa.load(file_path, sr=None)
+def load_audio(file_path, context=None):
+    y, sr = load_shared_audio(file_path, sr=None, context=context)
     return y, sr
 
-def plot_waveform_with_sampling_rate(file_path, filename, username):
+FIGSIZE = (14, 6)
+
+def plot_waveform_with_sampling_rate(file_path, filename, username, context=None):
+    features = waveform_features(file_path, context)
+    return render_waveform_with_sampling_rate(**features, output_path=render.plot_path(filename, username, 'waveform_with_sampling_rate'))
+
+def waveform_features(file_path, context=None):
     # Load the audio file
-    audio_data, sampling_rate = load_audio(file_path)
+    audio_data, sampling_rate = load_audio(file_path, context)
+
+    # Reduce the waveform to its min/max per pixel column
+    time, envelope = minmax_envelope(audio_data, sampling_rate, pixel_columns(FIGSIZE))
+    return {'time': time, 'envelope': envelope, 'sampling_rate': sampling_rate}
 
-    # Time axis for the waveform
-    time = np.linspace(0, len(audio_data) / sampling_rate, num=len(audio_data))
+def _waveform_template():
+    fig = render.new_figure(FIGSIZE)
+    ax = fig.add_subplot()
+    line, = ax.plot([], [], label='Audio waveform')
+    ax.set_xlabel('Time (seconds)')
+    ax.set_ylabel('Amplitude')
+    ax.grid(True)
+    ax.legend()
+    text = ax.text(0.5, 0, '', horizontalalignment='center', verticalalignment='top', fontsize=12, color='red')
+    return fig, ax, line, text
 
+def render_waveform_with_sampling_rate(time, envelope, sampling_rate, output_path):
     # Plot the waveform
-    plt.figure(figsize=(14, 6))
-    plt.plot(time, audio_data, label='Audio waveform')
-    plt.xlabel('Time (seconds)')
-    plt.ylabel('Amplitude')
-    plt.title(f'Audio Waveform and Sampling Rate: {sampling_rate} Hz')
-    plt.grid(True)
-    plt.legend()
+    fig, ax, line, text = render.template(_waveform_template)
+    line.set_data(time, envelope)
+    ax.set_title(f'Audio Waveform and Sampling Rate: {sampling_rate} Hz')
+    render.autoscale(ax)
 
     # Annotate the sampling rate
-    plt.text(0.5, max(audio_data), f'Sampling Rate: {sampling_rate} Hz', 
-             horizontalalignment='center', verticalalignment='top', fontsize=12, color='red')
+    text.set_position((0.5, np.max(envelope)))
+    text.set_text(f'Sampling Rate: {sampling_rate} Hz')
 
-    plot_filename = f"{username}_{filename}_waveform_with_sampling_rate.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+    with metrics.stage('savefig.plot_path_sr'):
+        render.save(fig, output_path)
     return output_path
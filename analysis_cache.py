@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import config
+from file_utils import evict_lru
+
+# Finished analyses keyed by the content hash of the audio and the analysis
+# parameters. Each entry is a directory holding result.json and a
+# "<name>.bin" file for every binary result (the plot features), so a
+# re-upload of the same audio reuses them instead of being decoded and
+# analyzed again. Entries are evicted least recently used first once the
+# cache grows past ANALYSIS_CACHE_MAX_BYTES.
+
+
+def cache_key(content_hash, params):
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{content_hash}_{fingerprint}"
+
+
+def _entry_dir(key):
+    return os.path.join(config.ANALYSIS_CACHE_DIR, key)
+
+
+def contains(key):
+    return os.path.exists(os.path.join(_entry_dir(key), 'result.json'))
+
+
+def lookup(key, filename):
+    # Return the cached results for this upload, or None if the audio has not
+    # been analyzed with these parameters
+    entry = _entry_dir(key)
+    try:
+        with open(os.path.join(entry, 'result.json')) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    results = dict(cached['metrics'], filename=filename)
+    try:
+        for name in cached['blobs']:
+            with open(os.path.join(entry, f"{name}.bin"), 'rb') as f:
+                results[name] = f.read()
+    except (OSError, KeyError):
+        # The entry is incomplete, e.g. evicted while we were reading it
+        return None
+
+    # Mark the entry as recently used
+    os.utime(entry)
+    return results
+
+
+def store(key, results):
+    entry = _entry_dir(key)
+    if contains(key):
+        return
+
+    # Build the entry under a temporary name so readers never see half of it
+    tmp_entry = f"{entry}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_entry)
+    blobs = []
+    metrics = {}
+    for name, value in results.items():
+        if isinstance(value, bytes):
+            with open(os.path.join(tmp_entry, f"{name}.bin"), 'wb') as f:
+                f.write(value)
+            blobs.append(name)
+        elif name not in ('filename', 'audio_id'):
+            metrics[name] = value
+    with open(os.path.join(tmp_entry, 'result.json'), 'w') as f:
+        json.dump({'metrics': metrics, 'blobs': blobs}, f)
+
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another worker stored the same audio first
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    evict()
+
+
+def evict(max_bytes=None):
+    # Remove least recently used entries until the cache fits in max_bytes
+    if max_bytes is None:
+        max_bytes = config.ANALYSIS_CACHE_MAX_BYTES
+    evict_lru(config.ANALYSIS_CACHE_DIR, max_bytes)
@@ -0,0 +1,114 @@
+import config
+import metrics
+import pcm_cache
+
+# librosa is only imported once audio is decoded, so modules that merely pass
+# contexts around (the web app, the job queue) do not load it.
+
+# librosa.load resamples to this rate when sr is not given
+DEFAULT_SR = 22050
+
+
+class AnalysisContext:
+    # Holds the decoded audio for one upload so every analysis shares it.
+    # The file is decoded from disk once at its native sampling rate; any
+    # other rate is resampled from that buffer and kept for later callers.
+    # With PCM_CACHE on and a content hash given, buffers are also kept in
+    # the decoded-audio cache and taken from it by later contexts.
+
+    def __init__(self, file_path, content_hash=None):
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.native_sr = None
+        self._buffers = {}
+        self._spectral = {}
+        self._derived = {}
+
+    @classmethod
+    def from_buffers(cls, file_path, native_sr, buffers, content_hash=None):
+        # Context around audio that was already decoded, e.g. by another process
+        context = cls(file_path, content_hash)
+        context.native_sr = native_sr
+        context._buffers.update(buffers)
+        return context
+
+    def buffers(self):
+        # Every buffer decoded or resampled so far, keyed by sampling rate
+        return dict(self._buffers)
+
+    def stfts(self):
+        # Every STFT taken of the buffers so far, keyed by sampling rate
+        return {sr: features.stft for sr, features in self._spectral.items() if features.has_stft}
+
+    def _cached(self):
+        return config.PCM_CACHE and self.content_hash is not None
+
+    def load(self, sr=DEFAULT_SR):
+        if sr is not None and sr not in self._buffers and self._cached():
+            # A cached buffer at this rate needs neither a decode nor a resample
+            y = pcm_cache.load(self.content_hash, sr)
+            if y is not None:
+                self._buffers[sr] = y
+                return y, sr
+
+        if self.native_sr is None:
+            native = pcm_cache.load_native(self.content_hash) if self._cached() else None
+            if native is not None:
+                y, self.native_sr = native
+            else:
+                import librosa
+                with metrics.stage('decode'):
+                    y, self.native_sr = librosa.load(self.file_path, sr=None)
+                if self._cached():
+                    y = pcm_cache.store(self.content_hash, self.native_sr, y, native=True)
+            self._buffers[self.native_sr] = y
+
+        if sr is None:
+            sr = self.native_sr
+
+        if sr not in self._buffers:
+            import librosa
+            y = self._buffers[self.native_sr]
+            with metrics.stage('resample'):
+                y = librosa.resample(y, orig_sr=self.native_sr, target_sr=sr)
+            if self._cached():
+                y = pcm_cache.store(self.content_hash, sr, y)
+            self._buffers[sr] = y
+
+        return self._buffers[sr], sr
+
+    def spectral(self, sr=DEFAULT_SR):
+        # Lazily computed STFT features of the buffer at this sampling rate
+        from spectral import SpectralFeatures
+
+        y, sr = self.load(sr)
+        if sr not in self._spectral:
+            self._spectral[sr] = SpectralFeatures(y, sr)
+        return self._spectral[sr]
+
+    def provide(self, name, value):
+        # A value computed outside the context, e.g. for a whole batch of
+        # uploads at once, handed out by derived() under name
+        self._derived[name] = value
+
+    def provide_stft(self, sr, stft):
+        # STFT of the buffer at sr computed outside the context
+        from spectral import SpectralFeatures
+
+        y, sr = self.load(sr)
+        self._spectral[sr] = SpectralFeatures(y, sr, stft)
+
+    def derived(self, name, compute):
+        # Value computed from the audio by compute() once, then shared by
+        # every analysis that asks for it under the same name
+        if name not in self._derived:
+            self._derived[name] = compute()
+        return self._derived[name]
+
+
+def load_audio(file_path, sr=DEFAULT_SR, context=None):
+    # Use the shared buffer when a context is given, otherwise decode the file
+    if context is not None:
+        return context.load(sr)
+    import librosa
+    return librosa.load(file_path, sr=sr)
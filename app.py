@@ -1,23 +1,28 @@
 import os
-import pymysql
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, Response,send_file
+import threading
+import db
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, Response,send_file, jsonify
 from werkzeug.utils import secure_filename
-from Bitrate import get_bitrate
-from DR import calculate_decibels_with_sampling_rate, plot_waveform_with_sampling_rate
-from loudness import get_loudness, plot_loudness
-from peak_level import plot_waveform_with_peak
-from silence_speech import plot_silence_speech_ratio_pie
-from file_utils import calculate_file_size
-from harmonicity import plot_harmonicity
-from tempo import estimate_tempo
+from probe import kbps, probe
+from pipeline import process_upload, is_cached, regenerate_tiles, PLOT_KEYS
+from file_utils import save_and_hash
+from ingest import HEADER_BYTES, IngestRequest, IngestStream, sniff_format
+from werkzeug.exceptions import RequestEntityTooLarge
+import jobs
+import tiles
+import plots
+import report
+import vad
+import metrics
+import config
 from datetime import datetime
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from PIL import Image
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+# Uploaded files are streamed to disk, hashed and sniffed as they arrive
+app.request_class = IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_BYTES
+app.add_template_filter(kbps)
 ALLOWED_EXTENSIONS = {'mp3', 'wav'}
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
 
@@ -28,42 +33,21 @@ if not os.path.exists('database'):
 if not os.path.exists('uploads'):
     os.makedirs('uploads')
 
-# Initialize the MySQL database
-def init_db():
-    conn = pymysql.connect(
-        host='localhost',
-        user='root',
-        password='',
-        db='audio',
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    cursor = conn.cursor()
-    # Check if the tables exist, if not, create them
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        username VARCHAR(255) UNIQUE NOT NULL,
-                        email VARCHAR(255) UNIQUE NOT NULL,
-                        password VARCHAR(255) NOT NULL)''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS uploads (
-                        audio_id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        filename VARCHAR(255) NOT NULL,
-                        bitrate INT NOT NULL,
-                        loudness_plot_path VARCHAR(255) NOT NULL,
-                        waveform_plot_path VARCHAR(255) NOT NULL,
-                        silence_speech_ratio_plot_path VARCHAR(255) NOT NULL,
-                        plot_path_sr VARCHAR(255) NOT NULL,
-                        harmonicity_plot_path VARCHAR(255) NOT NULL,
-                        decibels FLOAT,  -- Add decibels column
-                        tempo FLOAT,     -- Add tempo column
-                        file_size FLOAT, -- Add file_size column
-                        FOREIGN KEY (user_id) REFERENCES users(id))''')
-    conn.commit()
-    conn.close()
-
-# Call init_db() only once when the application starts
-init_db()
+# Initialize the database once, before the first request is handled rather
+# than at import, so a worker starts without waiting for the database
+_db_ready = False
+_db_lock = threading.Lock()
+
+
+@app.before_request
+def ensure_db():
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if not _db_ready:
+            db.init_db()
+            _db_ready = True
 
 #Home
 @app.route('/')
@@ -78,30 +62,19 @@ def signup():
         email = request.form['email']
         password = request.form['password']
         
-        # Connect to the database
-        conn = pymysql.connect(
-            host='localhost',
-            user='root',
-            password='',
-            db='audio',
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        cursor = conn.cursor()
-        
         try:
             # Insert new user into the database
-            cursor.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)', (username, email, password))
-            conn.commit()
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('INSERT INTO users (username, email, password) VALUES (%s, %s, %s)', (username, email, password))
+                conn.commit()
 
             # Set the session value
             session['username'] = username
 
-            conn.close()
             return redirect(url_for('index'))
-        except pymysql.MySQLError as e:
+        except db.Error as e:
             flash("Username already exists")
-            conn.close()
     
     return render_template('signup.html')
 
@@ -112,21 +85,12 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        # Connect to the MySQL database
-        conn = pymysql.connect(
-            host='localhost',
-            user='root',
-            password='',
-            db='audio',
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        cursor = conn.cursor()
-        
         try:
             # Fetch user details from the database
-            cursor.execute('SELECT * FROM users WHERE username = %s', (username,))
-            user = cursor.fetchone()
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM users WHERE username = %s', (username,))
+                user = cursor.fetchone()
             
             # Check if user exists and passwords match
             if user and user['password'] == password:  # Check password without hashing
@@ -135,11 +99,9 @@ def login():
                 return redirect(url_for('index'))
             else:
                 flash("Invalid username or password")
-        except pymysql.MySQLError as e:
+        except db.Error as e:
             flash("Database error")
             print(e)
-        finally:
-            conn.close()
     
     return render_template('login.html')
 
@@ -172,207 +134,277 @@ def upload():
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         filename = secure_filename(f"{timestamp}_{file.filename}")
         file_path = os.path.join('uploads', filename)
-        file.save(file_path)
+        # The body was hashed and sniffed while it was written to disk,
+        # re-uploads of known audio skip the analyses. The save stage starts
+        # when the body started streaming to disk during form parsing.
+        with metrics.stage('save', started=getattr(file.stream, 'started', None)):
+            if isinstance(file.stream, IngestStream):
+                file_format = file.stream.format
+                content_hash = file.stream.content_hash
+                file_size = file.stream.size
+                file.stream.commit(file_path)
+            else:
+                content_hash = save_and_hash(file, file_path)
+                with open(file_path, 'rb') as f:
+                    file_format = sniff_format(f.read(HEADER_BYTES))
+                file_size = os.path.getsize(file_path)
         
         # Check if the file is saved successfully
         if not os.path.exists(file_path):
             flash("Error saving the file")
             return redirect(request.url)
 
-        # Calculate the bitrate using the get_bitrate function
-        bitrate = get_bitrate(file_path)
+        if file_format is None:
+            os.remove(file_path)
+            flash("Unsupported file format. Only .mp3 and .wav are allowed.")
+            return redirect(request.url)
+
+        # Sample rate, channels, duration and bitrate from the headers, shown
+        # right away while the analyses run and handed on to them
+        with metrics.stage('probe'):
+            metadata = probe(file_path)
         
         # Check if bitrate calculation is successful
-        if bitrate is None:
+        if metadata is None or metadata['bitrate'] is None:
+            os.remove(file_path)
             flash("Error calculating bitrate")
             return redirect(request.url)
-        username = session.get('username')  # Get username from session
+        metadata.update(format=file_format, file_size=file_size / (1024 * 1024))
 
- 
-        # Plot the waveform with sampling rate and save the plot
-        plot_path_sr = plot_waveform_with_sampling_rate(file_path, filename, username)
+        if request.form.get('metadata_only'):
+            # Nothing is decoded or stored for metadata-only requests
+            os.remove(file_path)
+            return render_template('upload.html', metadata=metadata)
 
-        # Calculate decibels with sampling rate
-        decibels_value = calculate_decibels_with_sampling_rate(file_path)
-        decibels_with_units = f"{decibels_value:.2f} dB"
-        print(f"Decibels Value: {decibels_value}")
-
-        # Plot the loudness and save the plot
-        loudness_plot_path = plot_loudness(file_path, filename, username)
-        
-        # Plot the waveform with peak and save the plot
-        waveform_plot_path = plot_waveform_with_peak(file_path, filename, username)
-
-        # Plot the silence speech ratio pie chart and save the plot
-        silence_speech_ratio_plot_path = plot_silence_speech_ratio_pie(file_path, filename, username)
-
-        # Plot harmonicity and save the plot
-        harmonicity_plot_path = plot_harmonicity(file_path, filename, username)
-
-        # Estimate tempo and save the tempo value
-        tempo = estimate_tempo(file_path)
-        print(f"Tempo: {tempo}")
-
-        # Calculate the file size
-        file_size_mb = calculate_file_size(file_path)
-        
+        username = session.get('username')  # Get username from session
         user_id = session.get('user_id')  # Get user_id from session
 
-        # Connect to MySQL database
-        conn = pymysql.connect(
-            host='localhost',
-            user='root',
-            password='',
-            db='audio',
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        cursor = conn.cursor()
-        
-        try:
-            # Insert upload details into MySQL database
-            cursor.execute('INSERT INTO uploads (user_id,filename, bitrate, loudness_plot_path, waveform_plot_path, silence_speech_ratio_plot_path, plot_path_sr, harmonicity_plot_path, decibels, tempo, file_size) VALUES (%s,%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)', 
-                        (user_id,filename, bitrate, loudness_plot_path, waveform_plot_path, silence_speech_ratio_plot_path,  plot_path_sr, harmonicity_plot_path, decibels_with_units, tempo,file_size_mb))
-            conn.commit()
-            flash(f"File uploaded successfully with bitrate: {bitrate} kbps")
-        except pymysql.MySQLError as e:
-            flash("Error uploading file to database")
-            print(e)
-        finally:
-            conn.close()
-        
-        # Pass the paths of the generated graph images and tempo value to the template
-        return render_template('upload.html', plot_path_sr_var=plot_path_sr, loudness_plot_path=loudness_plot_path, waveform_plot_path=waveform_plot_path, silence_speech_ratio_plot_path=silence_speech_ratio_plot_path, file_size_var=f"{file_size_mb:.2f} MB", bitrate_var=f"{bitrate} kbps", harmonicity_plot_path=harmonicity_plot_path, tempo=tempo, decibels_var=decibels_with_units)
+        # Run the analyses and the database insert in the worker pool,
+        # upload.html polls the job status and shows the results when ready.
+        # Cached audio only needs the insert, so it is done right away. The
+        # uploaded file is removed if the analysis fails.
+        job_id = jobs.submit(process_upload, file_path, filename, username, user_id, config.PARALLEL_ANALYSIS, content_hash, metadata,
+                             owner=user_id, inline=is_cached(content_hash), progress=True, files=[file_path])
 
+        return render_template('upload.html', job_id=job_id, metadata=metadata)
 
     return render_template('upload.html')
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    flash(f"File too large, uploads are limited to {config.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    return redirect(url_for('upload'))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = jobs.get_status(job_id, owner=session.get('user_id'))
+    if status is None:
+        return jsonify({'status': 'unknown'}), 404
+
+    if 'result' in status:
+        result = status['result'] = dict(status['result'])
+        # Plots are rendered when the page first asks for them
+        for key in PLOT_KEYS:
+            result[key] = url_for('plot', record_id=result['audio_id'], name=key)
+        result['bitrate_kbps'] = kbps(result.get('bitrate'))
+    return jsonify(status)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Stage timings and memory of every upload handled since startup
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+# Columns history.html shows, the rest of the uploads row is never read there.
+# Plots are loaded through the plot route, only when they are displayed.
+HISTORY_COLUMNS = 'audio_id, filename, bitrate, file_size, decibels, tempo'
+
+# Views of the history, each served from one of the (user_id, column, audio_id) indexes
+HISTORY_SORTS = ('audio_id', 'tempo', 'decibels', 'file_size')
+
 @app.route('/history')
 def history():
     user_id = session.get('user_id')  # Get user_id from session
     if user_id is None:
         flash("You need to log in first")
         return redirect(url_for('login'))
-    
-    conn = pymysql.connect(
-        host='localhost',
-        user='root',
-        password='',
-        db='audio',
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM uploads WHERE user_id = %s', (user_id,))
-    uploads = cursor.fetchall()
-    conn.close()
-
-    # Preprocess the paths to replace backslashes with forward slashes
-    for upload in uploads:
-        upload['loudness_plot_path'] = upload['loudness_plot_path'].replace('\\', '/')
-        upload['waveform_plot_path'] = upload['waveform_plot_path'].replace('\\', '/')
-        upload['silence_speech_ratio_plot_path'] = upload['silence_speech_ratio_plot_path'].replace('\\', '/')
-        upload['plot_path_decibels'] = upload['plot_path_decibels'].replace('\\', '/')
-        upload['plot_path_sr'] = upload['plot_path_sr'].replace('\\', '/')
-        upload['harmonicity_plot_path'] = upload['harmonicity_plot_path'].replace('\\', '/')
-        
-        # Debugging print statements
-        print(f"Filename: {upload['filename']}, Decibels: {upload['decibels']}, Tempo: {upload['tempo']}")
 
+    sort = request.args.get('sort', 'audio_id')
+    if sort not in HISTORY_SORTS:
+        sort = 'audio_id'
+    order = 'ASC' if request.args.get('order') == 'asc' else 'DESC'
+    cursor_id = request.args.get('cursor_id', type=int)
+    min_value = request.args.get('min', type=float)
+    max_value = request.args.get('max', type=float)
+
+    # Keyset pagination: continue after the last row of the previous page
+    # instead of counting rows with OFFSET. The cursor is the audio_id of that
+    # row only; its sort value is read back from the row itself, since a value
+    # passed through the URL does not compare equal to a FLOAT column.
+    where = ['user_id = %s']
+    args = [user_id]
+    if sort != 'audio_id':
+        where.append(f'{sort} IS NOT NULL')
+        if min_value is not None:
+            where.append(f'{sort} >= %s')
+            args.append(min_value)
+        if max_value is not None:
+            where.append(f'{sort} <= %s')
+            args.append(max_value)
+    op = '>' if order == 'ASC' else '<'
+    if cursor_id is not None:
+        if sort == 'audio_id':
+            where.append(f'audio_id {op} %s')
+            args.append(cursor_id)
+        else:
+            cursor_row = f'(SELECT {sort} FROM uploads WHERE audio_id = %s AND user_id = %s)'
+            where.append(f'({sort} {op} {cursor_row} OR ({sort} = {cursor_row} AND audio_id {op} %s))')
+            args.extend([cursor_id, user_id, cursor_id, user_id, cursor_id])
+
+    order_by = f'audio_id {order}' if sort == 'audio_id' else f'{sort} {order}, audio_id {order}'
+    page_size = config.HISTORY_PAGE_SIZE
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        # One extra row tells whether there is a next page
+        cursor.execute(f"SELECT {HISTORY_COLUMNS} FROM uploads WHERE {' AND '.join(where)} ORDER BY {order_by} LIMIT %s",
+                       args + [page_size + 1])
+        uploads = cursor.fetchall()
+
+    next_page = None
+    if len(uploads) > page_size:
+        uploads = uploads[:page_size]
+        last = uploads[-1]
+        next_page = url_for('history', sort=sort, order=order.lower(), min=min_value, max=max_value,
+                            cursor_id=last['audio_id'])
+
+    for upload in uploads:
         # Removing time stamp from filename
         filename_parts = upload['filename'].split('_', 1)
         original_filename = filename_parts[1] if len(filename_parts) > 1 else upload['filename']
         upload['original_filename'] = original_filename
 
-    return render_template('history.html', uploads=uploads)
+    return render_template('history.html', uploads=uploads, next_page=next_page, sort=sort, order=order.lower(),
+                           min_value=min_value, max_value=max_value)
+
+def get_tiles_key(record_id):
+    # Tiles of an upload are only served to the user who uploaded it. Tiles
+    # evicted under TILES_MAX_BYTES are written again from the uploaded file.
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT filename, tiles_key FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, session.get('user_id')))
+        upload = cursor.fetchone()
+    if not upload or not upload['tiles_key']:
+        return None
+    key = upload['tiles_key']
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], upload['filename'])
+    if tiles.read_manifest(key) is None and os.path.exists(file_path):
+        regenerate_tiles(file_path, key)
+    return key
+
+@app.route('/tiles/<int:record_id>/manifest')
+def tiles_manifest(record_id):
+    key = get_tiles_key(record_id)
+    manifest = tiles.read_manifest(key) if key else None
+    if manifest is None:
+        return jsonify({'error': 'No tiles for this record'}), 404
+    return jsonify(manifest)
+
+# Bytes of tile rows read and sent at a time
+TILE_CHUNK_BYTES = 1024 * 1024
+
+@app.route('/tiles/<int:record_id>/<name>')
+def tile_data(record_id, name):
+    # Raw little endian rows of one zoom level ("wave_<level>") or of the
+    # spectrogram. ?start=&stop= select rows, a Range header selects bytes
+    # of those rows. Only the requested pages of the memory map are read.
+    key = get_tiles_key(record_id)
+    array = tiles.open_tile(key, name) if key else None
+    if array is None:
+        return jsonify({'error': 'No such tile'}), 404
+
+    start = max(0, request.args.get('start', 0, type=int))
+    stop = max(start, min(len(array), request.args.get('stop', len(array), type=int)))
+    # The arrays are C contiguous, a row is one stride
+    row_bytes = array.strides[0]
+    length = (stop - start) * row_bytes
+
+    status = 200
+    headers = {
+        'X-Dtype': array.dtype.str,
+        'X-Shape': ','.join(str(n) for n in (stop - start,) + array.shape[1:]),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=86400',
+    }
+    # Bytes first:last of the selected rows, only the rows they fall in are
+    # read and they are sent a chunk at a time
+    first, last = 0, length
+    byte_range = request.range.range_for_length(length) if request.range else None
+    if byte_range is not None:
+        first, last = byte_range
+        headers['Content-Range'] = f"bytes {first}-{last - 1}/{length}"
+        status = 206
+    headers['Content-Length'] = str(last - first)
+
+    def body():
+        rows_per_chunk = max(1, TILE_CHUNK_BYTES // row_bytes)
+        row = first // row_bytes
+        offset = first - row * row_bytes
+        remaining = last - first
+        while remaining > 0:
+            chunk = array[start + row:start + row + rows_per_chunk].tobytes()[offset:offset + remaining]
+            yield chunk
+            remaining -= len(chunk)
+            row += rows_per_chunk
+            offset = 0
+
+    return Response(body(), status=status, mimetype='application/octet-stream', headers=headers)
+
+@app.route('/records/<int:record_id>/speech_intervals')
+def speech_intervals(record_id):
+    # (start, end) seconds of the speech in an upload, from its stored index
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT speech_intervals FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, session.get('user_id')))
+        upload = cursor.fetchone()
+    if not upload or upload['speech_intervals'] is None:
+        return jsonify({'error': 'No speech intervals for this record'}), 404
+    return jsonify(vad.unpack_intervals(upload['speech_intervals']).tolist())
+
+@app.route('/records/<int:record_id>/plots/<name>')
+def plot(record_id, name):
+    # One plot of an upload, rendered from its stored features on the first
+    # request and served from the plot cache after that
+    if name not in plots.PLOTS:
+        return jsonify({'error': 'No such plot'}), 404
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT audio_id, {name}, plot_features FROM uploads WHERE audio_id = %s AND user_id = %s',
+                       (record_id, session.get('user_id')))
+        upload = cursor.fetchone()
+    path = plots.plot_file(upload, name) if upload else None
+    if path is None:
+        return jsonify({'error': 'No such plot'}), 404
+    return send_file(os.path.abspath(path))
 
 @app.route('/download_record/<int:record_id>')
 def download_record(record_id):
     username = session.get('username')
-    conn = pymysql.connect(
-        host='localhost',
-        user='root',
-        password='',
-        db='audio',
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM uploads WHERE audio_id = %s', (record_id,))
-    upload = cursor.fetchone()  # Fetch a single record
-    conn.close()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM uploads WHERE audio_id = %s', (record_id,))
+        upload = cursor.fetchone()  # Fetch a single record
     
     if not upload:
         flash("Record not found")
         return redirect(url_for('history'))
 
-    # Removing timestamp from filename
-    filename_parts = upload['filename'].split('_', 1)
-    original_filename = filename_parts[1] if len(filename_parts) > 1 else upload['filename']
-
-    # Create a PDF file
-    pdf_buffer = BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=letter)
-
-    # Add title
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(100, 750, "Audio Record Analysis")
-    c.setFont("Helvetica", 12)
-
-    # Add metadata
-    c.drawString(100, 730, f"Name: {username}")
-    c.drawString(100, 710, f"File Name: {original_filename}")
-    c.drawString(100, 690, f"Bitrate: {upload['bitrate']} kbps")
-
-    # Draw images
-    y_position = 650  # Adjust the starting position for drawing images
-
-    def draw_image(image_path, description, c, y_position):
-        if y_position < 100:
-            c.showPage()  # Start a new page if the current one is full
-            c.setFont("Helvetica-Bold", 16)
-            c.drawString(100, 750, "Audio Record Analysis (continued)")
-            c.setFont("Helvetica", 12)
-            y_position = 700
-        c.drawString(100, y_position, description)
-        y_position -= 20
-        image = Image.open(image_path)
-        aspect = image.height / float(image.width)
-        c.drawInlineImage(image, 100, y_position - 200 * aspect, width=400, height=200 * aspect)
-        return y_position - 200 * aspect - 30
-
-    y_position = draw_image(upload['loudness_plot_path'].replace('\\', '/'), "Loudness Plot", c, y_position)
-    y_position = draw_image(upload['waveform_plot_path'].replace('\\', '/'), "Waveform Plot", c, y_position)
-    y_position = draw_image(upload['silence_speech_ratio_plot_path'].replace('\\', '/'), "Silence/Speech Ratio Plot", c, y_position)
-    y_position = draw_image(upload['plot_path_decibels'].replace('\\', '/'), "Decibels Plot", c, y_position)
-    y_position = draw_image(upload['plot_path_sr'].replace('\\', '/'), "Sampling Rate Plot", c, y_position)
-    y_position = draw_image(upload['harmonicity_plot_path'].replace('\\', '/'), "Harmonicity Plot", c, y_position)
-
-    c.save()
-
-    # Save the PDF file to disk temporarily
-    pdf_filename = f"{original_filename}_history.pdf"
-    pdf_path = os.path.join("tmp", pdf_filename.replace(':', '_'))  # Replace illegal characters in filename
-    try:
-        with open(pdf_path, "wb") as f:
-            f.write(pdf_buffer.getvalue())
-    finally:
-        # Close the pdf_buffer
-        pdf_buffer.close()
-
-    # Send the PDF file as a response
-    response = send_file(pdf_path, mimetype='application/pdf', as_attachment=True)
-
-    # Remove the PDF file from disk after sending
-    try:
-        os.remove(pdf_path)
-    except Exception as e:
-        print(f"Error while removing file: {e}")
-
+    # Reports are cached per upload, so a repeat download is a single file read
+    response = send_file(report.get_report(upload, username), mimetype='application/pdf', as_attachment=True)
+    response.headers.set('Content-Disposition', 'attachment', filename=f"{report.original_filename(upload)}_history.pdf")
     return response
 
 # In your Flask app (app.py)
@@ -384,46 +416,35 @@ def delete_record(record_id):
         flash("You need to log in first")
         return redirect(url_for('login'))
 
-    conn = pymysql.connect(
-        host='localhost',
-        user='root',
-        password='',
-        db='audio',
-        charset='utf8mb4',
-        cursorclass=pymysql.cursors.DictCursor
-    )
-    cursor = conn.cursor()
+    with db.connection() as conn:
+        cursor = conn.cursor()
 
-    # Fetch the record details to get the file paths
-    cursor.execute('SELECT * FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, user_id))
-    upload = cursor.fetchone()
+        # Fetch the record details to get the file paths
+        cursor.execute('SELECT * FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, user_id))
+        upload = cursor.fetchone()
 
     if not upload:
         flash("Record not found")
-        conn.close()
         return redirect(url_for('history'))
 
-    # Delete the files from the filesystem
-    files_to_delete = [
-        upload['loudness_plot_path'],
-        upload['waveform_plot_path'],
-        upload['silence_speech_ratio_plot_path'],
-        upload['plot_path_decibels'],
-        upload['plot_path_sr'],
-        upload['harmonicity_plot_path'],
-        os.path.join(app.config['UPLOAD_FOLDER'], upload['filename'])
-    ]
+    # Delete the files from the filesystem, uploads with plots rendered on
+    # demand have no plot paths
+    files_to_delete = [upload[key] for key in PLOT_KEYS + plots.LEGACY_PLOT_KEYS if upload.get(key)]
+    files_to_delete.append(os.path.join(app.config['UPLOAD_FOLDER'], upload['filename']))
 
     for file_path in files_to_delete:
         try:
             os.remove(file_path.replace('\\', '/'))
         except Exception as e:
             print(f"Error while removing file: {e}")
+    report.discard_reports(record_id)
+    plots.discard_plots(record_id)
 
     # Delete the record from the database
-    cursor.execute('DELETE FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, user_id))
-    conn.commit()
-    conn.close()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM uploads WHERE audio_id = %s AND user_id = %s', (record_id, user_id))
+        conn.commit()
 
     flash("Record deleted successfully")
     return redirect(url_for('history'))
@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+import batch_features
+import config
+import db
+from analysis_context import AnalysisContext
+from file_utils import hash_file, link_or_copy
+from pipeline import analyze_cached, is_cached, save_uploads
+from probe import probe
+from tempo import ACCURACIES
+
+# Batch analysis of whole directories of audio, for backfilling archives:
+#
+#   python batch.py <directory or manifest> --user <username>
+#
+# A manifest is a text file with one audio path per line. Every file is
+# linked into uploads/ and analyzed exactly like an upload, over a process
+# pool. Results are inserted BATCH_SIZE rows at a time and the files that
+# made it into the database are appended to a checkpoint, so an interrupted
+# run picks up where it stopped when started again. Clips shorter than
+# SHORT_SECONDS go to the workers in groups of SHORT_GROUP_SIZE, whose level,
+# frame RMS and STFT batch_features computes together.
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav')
+
+# Rows collected before they are inserted and checkpointed
+BATCH_SIZE = 50
+
+# Clips analyzed in groups, and the clips per group
+SHORT_SECONDS = 30
+SHORT_GROUP_SIZE = 16
+
+
+def find_audio(source):
+    # Audio files of a directory tree, or the paths listed in a manifest
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(AUDIO_EXTENSIONS))
+        return paths
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def checkpoint_path(source, username):
+    # One checkpoint per source and user
+    digest = hashlib.sha256(f"{os.path.abspath(source)}\0{username}".encode()).hexdigest()[:16]
+    return os.path.join(config.BATCH_CHECKPOINT_DIR, f"{digest}.txt")
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def _append_checkpoint(path, sources):
+    with open(path, 'a') as f:
+        f.writelines(f"{source}\n" for source in sources)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def analyze_files(sources, username):
+    # Worker side: bring files into uploads/ and analyze them like uploads.
+    # Returns (source, results, error) for every file. The files of a group
+    # of short clips are decoded first and their features computed together.
+    prepared = []
+    outcomes = []
+    for source in sources:
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        filename = secure_filename(f"{timestamp}_{os.path.basename(source)}")
+        file_path = os.path.join('uploads', filename)
+        try:
+            link_or_copy(source, file_path)
+            content_hash = hash_file(file_path)
+        except Exception as e:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            outcomes.append((source, None, e))
+            continue
+        prepared.append((source, file_path, filename, content_hash, AnalysisContext(file_path, content_hash)))
+
+    # Clips in the analysis cache are not decoded at all
+    uncached = [context for _, _, _, content_hash, context in prepared if not is_cached(content_hash)]
+    if len(uncached) > 1:
+        batch_features.prime_contexts(uncached)
+
+    for source, file_path, filename, content_hash, context in prepared:
+        try:
+            metadata = probe(file_path)
+            if metadata is None or metadata['bitrate'] is None:
+                raise ValueError("Error calculating bitrate")
+            results = analyze_cached(file_path, filename, username, content_hash=content_hash, metadata=metadata, context=context)
+            outcomes.append((source, results, None))
+        except Exception as e:
+            os.remove(file_path)
+            outcomes.append((source, None, e))
+    return outcomes
+
+
+def group_sources(sources):
+    # Worker tasks: short clips in groups of similar length, every other
+    # file (or one whose length is unknown) on its own
+    durations = {}
+    for source in sources:
+        metadata = probe(source)
+        durations[source] = metadata['duration'] if metadata else None
+    short = sorted((source for source in sources if durations[source] is not None and durations[source] < SHORT_SECONDS),
+                   key=durations.get)
+    short_set = set(short)
+    tasks = [short[i:i + SHORT_GROUP_SIZE] for i in range(0, len(short), SHORT_GROUP_SIZE)]
+    return tasks + [[source] for source in sources if source not in short_set]
+
+
+def get_user_id(username):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM users WHERE username = %s', (username,))
+        user = cursor.fetchone()
+    return user['id'] if user else None
+
+
+def run_batch(source, username, workers=None, batch_size=BATCH_SIZE, checkpoint=None):
+    # Analyze every file of source not in the checkpoint yet and return
+    # the number of files analyzed and failed
+    user_id = get_user_id(username)
+    if user_id is None:
+        raise ValueError(f"No such user: {username}")
+
+    checkpoint = checkpoint or checkpoint_path(source, username)
+    os.makedirs(os.path.dirname(checkpoint) or '.', exist_ok=True)
+    os.makedirs('uploads', exist_ok=True)
+    done = read_checkpoint(checkpoint)
+    sources = [path for path in find_audio(source) if path not in done]
+    print(f"{len(sources)} files to analyze, {len(done)} already done")
+
+    analyzed = failed = 0
+    pending = []
+
+    def flush():
+        # Insert the collected rows, then record their files as done
+        save_uploads(user_id, [results for _, results in pending])
+        _append_checkpoint(checkpoint, [path for path, _ in pending])
+        pending.clear()
+
+    with ProcessPoolExecutor(max_workers=workers or config.ANALYSIS_PROCESSES) as pool:
+        futures = {pool.submit(analyze_files, task, username): task for task in group_sources(sources)}
+        for future in as_completed(futures):
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                outcomes = [(path, None, e) for path in futures[future]]
+            for path, results, error in outcomes:
+                if error is None:
+                    pending.append((path, results))
+                    analyzed += 1
+                else:
+                    failed += 1
+                    print(f"Error analyzing {path}: {error}", file=sys.stderr)
+            if len(pending) >= batch_size:
+                flush()
+                print(f"{analyzed + failed}/{len(sources)} files")
+        flush()
+
+    return analyzed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of audio files into the uploads table")
+    parser.add_argument('source', help="directory of .mp3/.wav files, or a text file listing one path per line")
+    parser.add_argument('--user', required=True, help="username the uploads are stored for")
+    parser.add_argument('--workers', type=int, default=None, help="analysis processes, defaults to ANALYSIS_PROCESSES")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="rows inserted per transaction")
+    parser.add_argument('--checkpoint', default=None, help="checkpoint file, defaults to one per source and user")
+    parser.add_argument('--tempo-accuracy', choices=ACCURACIES, default=config.TEMPO_ACCURACY,
+                        help="tempo estimation setting, defaults to TEMPO_ACCURACY; fast is opt-in, see bench_tempo.py")
+    args = parser.parse_args(argv)
+
+    # Through the environment as well, for workers that import config afresh
+    config.TEMPO_ACCURACY = os.environ['TEMPO_ACCURACY'] = args.tempo_accuracy
+
+    db.init_db()
+    analyzed, failed = run_batch(args.source, args.user, args.workers, args.batch_size, args.checkpoint)
+    print(f"Analyzed {analyzed} files, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
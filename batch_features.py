@@ -0,0 +1,122 @@
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+
+import metrics
+import vad
+from analysis_context import DEFAULT_SR
+
+# Features of many short clips computed together. The clips are zero padded
+# to a common length and stacked into one 2-D array, so the level, the frame
+# RMS and the STFT each take a single vectorized pass over all of them
+# instead of one call per clip. Per-clip results are split back out at the
+# end, padding excluded.
+#
+# The results are handed to the analysis context of each clip (see
+# prime_contexts), where the analyses of pipeline.py pick them up as if they
+# had computed them: the level through DR.py, the frame RMS through the VAD
+# of silence_speech.py with the config settings, and the STFT through the
+# spectral store behind loudness, harmonicity, tempo and the tiles. The
+# analyses themselves are unchanged, so a clip analyzed in a batch gets the
+# same results as an upload of it.
+
+# Frame layout of librosa's defaults, shared by vad.py and spectral.py
+FRAME_LENGTH = vad.FRAME_LENGTH
+HOP_LENGTH = vad.HOP_LENGTH
+
+# Most padded samples stacked at once, about eight 30 s clips at 22050 Hz;
+# the STFT of a batch takes roughly 16 bytes per sample
+BATCH_SAMPLES = 8 * 30 * DEFAULT_SR
+
+
+def stack_signals(signals):
+    # (n, length) float32 array of the signals padded to a whole number of
+    # hops, and the length of each
+    lengths = np.array([len(y) for y in signals], dtype=np.int64)
+    length = int(np.ceil(max(1, lengths.max()) / HOP_LENGTH)) * HOP_LENGTH
+    stacked = np.zeros((len(signals), length), dtype=np.float32)
+    for row, y in zip(stacked, signals):
+        row[:len(y)] = y
+    return stacked, lengths
+
+
+def _frames(stacked):
+    # Centered frames of every row, (n, frames, FRAME_LENGTH), as librosa
+    # frames a signal with center=True and zero padding
+    padded = np.pad(stacked, ((0, 0), (FRAME_LENGTH // 2, FRAME_LENGTH // 2)))
+    return sliding_window_view(padded, FRAME_LENGTH, axis=1)[:, ::HOP_LENGTH]
+
+
+def _frame_rms(stacked, n_frames):
+    # RMS of the centered frames from a running sum of squares, one
+    # subtraction per frame instead of a pass over its FRAME_LENGTH samples
+    squares = np.pad(stacked.astype(np.float64) ** 2, ((0, 0), (FRAME_LENGTH // 2 + 1, FRAME_LENGTH // 2)))
+    cumulative = np.cumsum(squares, axis=1)
+    starts = np.arange(n_frames) * HOP_LENGTH
+    sums = cumulative[:, starts + FRAME_LENGTH] - cumulative[:, starts]
+    return np.sqrt(np.maximum(sums, 0) / FRAME_LENGTH).astype(np.float32)
+
+
+def mean_squares(signals):
+    # Mean square of each signal, at whatever rate each one has, as
+    # DR.calculate_decibels_with_sampling_rate takes it at the native rate
+    stacked, lengths = stack_signals(signals)
+    return np.einsum('ij,ij->i', stacked, stacked, dtype=np.float64) / np.maximum(lengths, 1)
+
+
+def extract_features(signals):
+    # Frame RMS (as vad.frame_rms) and complex STFT (as librosa.stft with
+    # its defaults) of signals sharing one sampling rate, a dict per signal
+    if not len(signals):
+        return []
+    stacked, lengths = stack_signals(signals)
+    n_frames = 1 + lengths // HOP_LENGTH
+    rms = _frame_rms(stacked, stacked.shape[1] // HOP_LENGTH + 1)
+
+    # Periodic Hann window, as librosa.stft
+    window = np.hanning(FRAME_LENGTH + 1)[:-1].astype(np.float32)
+    stft = scipy.fft.rfft(_frames(stacked) * window, axis=2, workers=-1).astype(np.complex64)
+
+    return [{'rms': rms[i, :n_frames[i]], 'stft': np.ascontiguousarray(stft[i, :n_frames[i]].T)}
+            for i in range(len(signals))]
+
+
+def _batches(lengths, batch_samples):
+    # Indices in batches of similar length, so little of each batch is
+    # padding. A batch is full when adding the next (longest so far) clip
+    # would take it past batch_samples padded samples.
+    batch = []
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        if batch and lengths[i] * (len(batch) + 1) > batch_samples:
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def prime_contexts(contexts, sr=DEFAULT_SR, batch_samples=BATCH_SAMPLES):
+    # Decode the clips of the contexts and hand each context its level, frame
+    # RMS and STFT computed in batches. A clip that cannot be decoded is left
+    # out, its own analysis reports the error.
+    decoded = []
+    for context in contexts:
+        try:
+            native, _ = context.load(None)
+            y, _ = context.load(sr)
+        except Exception:
+            continue
+        decoded.append((context, native, y))
+    if not decoded:
+        return
+
+    with metrics.stage('batch_features'):
+        for batch in _batches([len(native) for _, native, _ in decoded], batch_samples):
+            for i, mean_square in zip(batch, mean_squares([decoded[i][1] for i in batch])):
+                decoded[i][0].provide('mean_square', mean_square)
+
+        for batch in _batches([len(y) for _, _, y in decoded], batch_samples):
+            for i, features in zip(batch, extract_features([decoded[i][2] for i in batch])):
+                context = decoded[i][0]
+                context.provide(('frame_rms', sr), features['rms'])
+                context.provide_stft(sr, features['stft'])
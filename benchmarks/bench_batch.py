@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import batch_features
+import fixtures
+import plots
+from analysis_context import AnalysisContext
+from pipeline import PLOT_KEYS, analyze_upload
+
+# Short clips analyzed one by one and as a batch, as batch.py groups them:
+#
+#   python benchmarks/bench_batch.py [--fixtures DIR] [--durations 2 10 25]
+#
+# Every fixture kind at each duration, mono WAV and stereo MP3, is analyzed
+# through pipeline.analyze_upload once with a fresh context per clip and once
+# with the contexts primed by batch_features.prime_contexts. Both runs must
+# give the same results: numbers and plot features within RTOL, speech
+# intervals within one frame. The exit status is 1 if any result differs.
+
+RTOL = 1e-3
+# One hop of the VAD at 22050 Hz, in seconds
+INTERVAL_TOLERANCE = 512 / 22050 + 1e-6
+
+
+def _close(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    if a.shape != b.shape:
+        return False
+    return np.allclose(a, b, rtol=RTOL, atol=RTOL * max(1e-12, np.max(np.abs(b), initial=0)))
+
+
+def compare(single, batched):
+    # Keys whose results differ between the two runs
+    differing = []
+    for key in ('decibels', 'tempo', 'bitrate', 'file_size'):
+        if not _close(single[key], batched[key]):
+            differing.append(key)
+    a, b = np.asarray(single['speech_intervals']).reshape(-1, 2), np.asarray(batched['speech_intervals']).reshape(-1, 2)
+    if a.shape != b.shape or (len(a) and np.max(np.abs(a - b)) > INTERVAL_TOLERANCE):
+        differing.append('speech_intervals')
+    for key in PLOT_KEYS:
+        x = plots.unpack_features(single['plot_features'], key)
+        y = plots.unpack_features(batched['plot_features'], key)
+        if x.keys() != y.keys() or not all(_close(x[name], y[name]) for name in x):
+            differing.append(key)
+    return differing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check batched short clip analysis against the per-file pipeline")
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'audio-bench-fixtures'))
+    parser.add_argument('--durations', type=float, nargs='+', default=[2, 10, 25])
+    args = parser.parse_args(argv)
+
+    paths = fixtures.ensure_fixtures(args.fixtures, [int(seconds) if seconds == int(seconds) else seconds for seconds in args.durations])
+    names = [os.path.basename(path) for path in paths]
+
+    start = time.perf_counter()
+    single = [analyze_upload(path, name, None) for path, name in zip(paths, names)]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    contexts = [AnalysisContext(path) for path in paths]
+    batch_features.prime_contexts(contexts)
+    batched = [analyze_upload(path, name, None, context=context) for path, name, context in zip(paths, names, contexts)]
+    batched_time = time.perf_counter() - start
+
+    failed = False
+    for name, a, b in zip(names, single, batched):
+        differing = compare(a, b)
+        failed = failed or bool(differing)
+        print(f"{name:32} {'ok' if not differing else 'DIFFERS: ' + ', '.join(differing)}")
+    print(f"one by one {single_time:8.2f} s")
+    print(f"batched    {batched_time:8.2f} s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
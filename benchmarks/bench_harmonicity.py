@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import fixtures
+from analysis_context import AnalysisContext, DEFAULT_SR
+from harmonicity import get_harmonicity
+
+# Compare the magnitude-domain harmonicity engine with full HPSS:
+#
+#   python benchmarks/bench_harmonicity.py [audio files]
+#
+# Without files the engines are compared on synthetic signals generated in
+# memory (the benchmark fixtures and a tone over clicks), so the check needs
+# no audio on disk. The STFT is computed once per signal before timing, as
+# the other analyses share it. Each decimation is checked against the hpss
+# curve: the same number of frames and a relative error
+# ||curve - hpss|| / ||hpss|| of at most MAX_ERROR. The exit status is 1 if
+# any check fails.
+#
+# The magnitude engine takes the RMS of Hann windowed frames where hpss
+# measures rectangular frames of the resynthesized signal, which only agree
+# on steady sounds. The synthetic speech (short bursts between pauses) is
+# therefore reported but not checked; it is why hpss stays the default.
+
+DECIMATIONS = (1, 2, 4)
+MAX_ERROR = 0.15
+
+SYNTHETIC_SECONDS = 10
+
+# Synthetic signals the engines are expected to agree on
+STEADY_SIGNALS = ('tone', 'noise', 'tone+clicks')
+
+
+def _timed(file_path, y, sr, engine):
+    context = AnalysisContext.from_buffers(file_path, sr, {sr: y})
+    context.spectral().stft
+    start = time.perf_counter()
+    curve = get_harmonicity(file_path, context=context, engine=engine)
+    return curve, time.perf_counter() - start
+
+
+def synthetic_signals():
+    # {name: (y, sr)} at DEFAULT_SR: the fixture signals, and a tone over
+    # clicks so the separation has percussive energy to remove
+    rng = np.random.default_rng(0)
+    t = np.arange(SYNTHETIC_SECONDS * fixtures.SAMPLE_RATE) / fixtures.SAMPLE_RATE
+    signals = {kind: fixtures.GENERATORS[kind](t, rng) for kind in ('tone', 'noise', 'speech')}
+    clicks = np.zeros(len(t))
+    clicks[::fixtures.SAMPLE_RATE // 4] = 1.0
+    signals['tone+clicks'] = signals['tone'] + clicks
+    return {name: AnalysisContext.from_buffers(name, fixtures.SAMPLE_RATE, {fixtures.SAMPLE_RATE: y.astype(np.float32)}).load(DEFAULT_SR)
+            for name, y in signals.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the harmonicity engines")
+    parser.add_argument('files', nargs='*', help="audio files, synthetic signals if none are given")
+    args = parser.parse_args(argv)
+
+    if args.files:
+        signals = {file_path: AnalysisContext(file_path).load(DEFAULT_SR) for file_path in args.files}
+    else:
+        signals = synthetic_signals()
+
+    failed = False
+    for file_path, (y, sr) in signals.items():
+        checked = bool(args.files) or file_path in STEADY_SIGNALS
+        reference, reference_time = _timed(file_path, y, sr, 'hpss')
+        print(f"{file_path} ({len(y) / sr:.1f} s)")
+        print(f"  {'hpss':<14} {reference_time * 1000:9.1f} ms")
+        for decimate in DECIMATIONS:
+            config.HARMONICITY_DECIMATE = decimate
+            curve, elapsed = _timed(file_path, y, sr, 'magnitude')
+            ok = len(curve) == len(reference)
+            error = np.linalg.norm(curve - reference) / max(np.linalg.norm(reference), 1e-12) if ok else np.inf
+            ok = ok and error <= MAX_ERROR
+            failed = failed or (checked and not ok)
+            status = ('ok' if ok else 'FAILED') if checked else 'not checked'
+            print(f"  {f'magnitude / {decimate}':<14} {elapsed * 1000:9.1f} ms  relative error {error:.3f}  {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of a web worker, each run in a fresh interpreter:
+#
+#   python benchmarks/bench_import.py [--repeat 5]
+#
+# Shows the time of "import app", the time until the first request (/login)
+# is answered, the peak RSS after it and which of the heavy analysis and
+# report stacks were loaded along the way. Run against the sqlite backend in
+# a temporary directory, so no database server is needed.
+
+HEAVY = ('librosa', 'numba', 'scipy', 'matplotlib', 'reportlab')
+
+CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/login')
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'first_request': answered - start,
+    'rss_peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (HEAVY,)
+
+
+def run_once(directory):
+    env = dict(os.environ, PYTHONPATH=ROOT, DB_BACKEND='sqlite', SQLITE_PATH=os.path.join(directory, 'audio.db'),
+               METRICS_LOG='0')
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=directory, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start of the web app")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters to start, medians are shown")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        runs = [run_once(directory) for _ in range(args.repeat)]
+
+    print(f"import app       {statistics.median(run['import'] for run in runs) * 1000:8.1f} ms")
+    print(f"first request    {statistics.median(run['first_request'] for run in runs) * 1000:8.1f} ms")
+    print(f"peak RSS         {statistics.median(run['rss_peak'] for run in runs) / 2 ** 20:8.1f} MB")
+    print(f"loaded           {', '.join(runs[-1]['loaded']) or 'none of ' + ', '.join(HEAVY)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+# Benchmarks of every analyzer and of the whole /upload flow:
+#
+#   python benchmarks/bench_suite.py [--sizes quick|full] [--output results.json]
+#                                    [--baseline baseline.json]
+#
+# Synthetic fixtures (see fixtures.py) are generated once into --fixtures.
+# Each analyzer is timed on buffers that are already decoded, so decoding
+# is reported as a benchmark of its own. The upload flow goes through Flask's
+# test client against the sqlite stand-in, in a scratch directory, once with
+# an empty analysis cache and once as a re-upload served from the cache.
+#
+# Every benchmark reports latency percentiles over --repeat runs, throughput
+# in seconds of audio per second, and the peak of traced allocations of one
+# extra run. The results are written as JSON; given a baseline from an
+# earlier run, every benchmark is compared to it and the exit status is 1 if
+# any got slower by more than --tolerance.
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+def _measure(fn, repeat, audio_seconds):
+    # Latencies of repeat runs, then one traced run for the allocation peak
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    p50 = _percentile(latencies, 50)
+    return {
+        'runs': repeat,
+        'p50': p50,
+        'p90': _percentile(latencies, 90),
+        'p99': _percentile(latencies, 99),
+        'max': max(latencies),
+        'throughput': audio_seconds / p50 if p50 else None,
+        'peak_alloc_bytes': peak,
+    }
+
+
+def _analyzers():
+    # name -> fn(file_path, context) of every analyzer
+    import DR
+    import harmonicity
+    import loudness
+    import peak_level
+    import render
+    import silence_speech
+    import tempo
+    from Bitrate import get_bitrate
+    from file_utils import calculate_file_size
+    from probe import probe
+
+    def plot(fn):
+        # Timed until the image is on disk, background encoding included
+        def run(file_path, context):
+            path = fn(file_path, 'bench', 'bench', context=context)
+            render.flush()
+            return path
+        return run
+
+    return {
+        'probe': lambda file_path, context: probe(file_path),
+        'bitrate': lambda file_path, context: get_bitrate(file_path),
+        'file_size': lambda file_path, context: calculate_file_size(file_path),
+        'decibels': lambda file_path, context: DR.calculate_decibels_with_sampling_rate(file_path, context=context),
+        'waveform_with_sampling_rate': plot(DR.plot_waveform_with_sampling_rate),
+        'loudness': plot(loudness.plot_loudness),
+        'waveform_with_peak': plot(peak_level.plot_waveform_with_peak),
+        'silence_speech': plot(silence_speech.plot_silence_speech_ratio_pie),
+        'harmonicity': plot(harmonicity.plot_harmonicity),
+        'tempo': lambda file_path, context: tempo.estimate_tempo(file_path, context=context),
+    }
+
+
+def bench_analyzers(paths, repeat, max_seconds):
+    from analysis_context import AnalysisContext, DEFAULT_SR
+    from probe import probe
+
+    results = {}
+    analyzers = _analyzers()
+    for file_path in paths:
+        seconds = probe(file_path)['duration']
+        if seconds > max_seconds:
+            # Long files are analyzed by streaming, measured by the upload flow
+            continue
+        name = os.path.basename(file_path)
+        print(f"analyzers: {name}")
+
+        results[f"decode/{name}"] = _measure(lambda: AnalysisContext(file_path).load(DEFAULT_SR), repeat, seconds)
+
+        context = AnalysisContext(file_path)
+        native, native_sr = context.load(None)
+        resampled, _ = context.load(DEFAULT_SR)
+        buffers = {native_sr: native, DEFAULT_SR: resampled}
+        for analyzer, fn in analyzers.items():
+            # A fresh context per run, so nothing computed by a run is reused
+            run = lambda: fn(file_path, AnalysisContext.from_buffers(file_path, native_sr, buffers))
+            results[f"{analyzer}/{name}"] = _measure(run, repeat, seconds)
+    return results
+
+
+def bench_upload(paths, repeat):
+    # The /upload flow end to end, run inside the request, from the scratch directory
+    import config
+    from app import app
+    from probe import probe
+
+    client = app.test_client()
+    client.post('/signup', data={'username': 'bench', 'email': 'bench@example.com', 'password': 'bench'})
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    def upload(file_path):
+        with open(file_path, 'rb') as f:
+            response = client.post('/upload', data={'file': (f, os.path.basename(file_path))}, content_type='multipart/form-data')
+        job = re.search(r'/jobs/([0-9a-f]+)', response.get_data(as_text=True))
+        status = client.get(f'/jobs/{job.group(1)}').get_json() if job else {'status': 'rejected'}
+        if status['status'] != 'done':
+            raise RuntimeError(f"Upload of {file_path} failed: {status}")
+
+    def cold_upload(file_path):
+        shutil.rmtree(config.ANALYSIS_CACHE_DIR, ignore_errors=True)
+        upload(file_path)
+
+    results = {}
+    for file_path in paths:
+        name = os.path.basename(file_path)
+        seconds = probe(file_path)['duration']
+        print(f"upload: {name}")
+        results[f"upload/{name}"] = _measure(lambda: cold_upload(file_path), repeat, seconds)
+        results[f"upload_cached/{name}"] = _measure(lambda: upload(file_path), repeat, seconds)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Print the change of every benchmark against the baseline, and return
+    # the names of those that got slower by more than tolerance
+    slower = []
+    for name, result in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = result['p50'] / previous['p50'] if previous['p50'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            flag = '  SLOWER'
+        print(f"  {name:<60} {previous['p50'] * 1000:10.1f} ms -> {result['p50'] * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analyzers and the upload flow")
+    parser.add_argument('--sizes', choices=sorted(fixtures.SIZES), default='quick', help="fixture durations to run")
+    parser.add_argument('--fixtures', default=os.path.join(ROOT, 'cache', 'bench_fixtures'), help="directory of the generated fixtures")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument('--max-analyzer-seconds', type=float, default=600, help="longest fixture the analyzers are timed on")
+    parser.add_argument('--skip-upload', action='store_true', help="only time the analyzers")
+    parser.add_argument('--output', default=None, help="write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    fixture_dir = os.path.abspath(args.fixtures)
+    print(f"Generating fixtures in {fixture_dir}")
+    paths = fixtures.ensure_fixtures(fixture_dir, fixtures.SIZES[args.sizes])
+
+    # Plots, uploads, caches and the sqlite database go to a scratch
+    # directory, never into the tree. The settings are read when config is
+    # first imported, so they are set before any module of the app is loaded.
+    workdir = tempfile.mkdtemp(prefix='audio-bench-')
+    os.environ.update(DB_BACKEND='sqlite', ANALYSIS_WORKERS='0', METRICS_LOG='0')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    for directory in ('static', 'uploads', 'database'):
+        os.makedirs(directory)
+    try:
+        benchmarks = bench_analyzers(paths, args.repeat, args.max_analyzer_seconds)
+        if not args.skip_upload:
+            benchmarks.update(bench_upload(paths, args.repeat))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+        'benchmarks': benchmarks,
+    }
+
+    print(f"{'benchmark':<60} {'p50 ms':>10} {'p90 ms':>10} {'x realtime':>11} {'peak MB':>9}")
+    for name, result in sorted(benchmarks.items()):
+        throughput = f"{result['throughput']:11.1f}" if result['throughput'] else f"{'-':>11}"
+        print(f"{name:<60} {result['p50'] * 1000:10.1f} {result['p90'] * 1000:10.1f} {throughput} "
+              f"{result['peak_alloc_bytes'] / 2 ** 20:9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['benchmarks']
+        print(f"Compared with {args.baseline}")
+        slower = compare(benchmarks, baseline, args.tolerance)
+        if slower:
+            print(f"{len(slower)} benchmarks slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
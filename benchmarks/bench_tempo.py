@@ -0,0 +1,82 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_context import AnalysisContext, DEFAULT_SR
+from tempo import estimate_tempo
+
+# Compare the tempo settings against each other on sample files:
+#
+#   python benchmarks/bench_tempo.py [audio files, default uploads/*]
+#
+# For every file the audio is decoded once up front, so the times are those
+# of the tempo estimation only. The BPM of every setting is shown next to
+# the accurate one, octave errors (half or double tempo) marked as such.
+# A setting agrees when it is within TOLERANCE of the accurate BPM; the exit
+# status is 1 if any fast setting does not on any file, as the fast mode
+# stays opt-in (config.TEMPO_ACCURACY) until it agrees.
+
+SETTINGS = [
+    ('accurate', {'accuracy': 'accurate'}),
+    ('fast, whole file', {'accuracy': 'fast', 'windows': 0}),
+    ('fast, 3 x 20 s', {'accuracy': 'fast', 'windows': 3, 'window_seconds': 20}),
+    ('fast, 1 x 30 s', {'accuracy': 'fast', 'windows': 1, 'window_seconds': 30}),
+]
+
+# Relative BPM difference still counted as the same tempo
+TOLERANCE = 0.04
+
+
+def _compare(bpm, reference):
+    if abs(bpm - reference) <= TOLERANCE * reference:
+        return 'match'
+    if any(abs(bpm - reference * factor) <= TOLERANCE * reference * factor for factor in (0.5, 2)):
+        return 'octave'
+    return 'differs'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tempo accuracy settings")
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--repeat', type=int, default=3, help="runs per setting, the best time is shown")
+    args = parser.parse_args(argv)
+
+    files = args.files or sorted(glob.glob(os.path.join('uploads', '*.mp3')) + glob.glob(os.path.join('uploads', '*.wav')))
+    if not files:
+        parser.error("no audio files given and none found in uploads/")
+
+    totals = {name: 0.0 for name, _ in SETTINGS}
+    disagreements = 0
+    for file_path in files:
+        y, sr = AnalysisContext(file_path).load(DEFAULT_SR)
+        print(f"{file_path} ({len(y) / sr:.1f} s)")
+        reference = None
+        for name, kwargs in SETTINGS:
+            times = []
+            for _ in range(args.repeat):
+                # A fresh context each run, so no onset envelope is reused
+                context = AnalysisContext.from_buffers(file_path, sr, {sr: y})
+                start = time.perf_counter()
+                bpm = float(np.ravel(estimate_tempo(file_path, context=context, **kwargs))[0])
+                times.append(time.perf_counter() - start)
+            reference = bpm if reference is None else reference
+            totals[name] += min(times)
+            verdict = _compare(bpm, reference)
+            disagreements += verdict != 'match'
+            print(f"  {name:<18} {bpm:8.2f} BPM {min(times) * 1000:9.1f} ms  {verdict}")
+
+    print("Total")
+    for name, _ in SETTINGS:
+        print(f"  {name:<18} {totals[name] * 1000:9.1f} ms")
+    print(f"{disagreements} fast results outside {TOLERANCE:.0%} of accurate")
+    return 1 if disagreements else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
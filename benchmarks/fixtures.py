@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+# Synthetic audio for the benchmarks, generated locally and deterministically
+# from a seed so runs on different machines analyze the same signals:
+#   tone     harmonic tone with vibrato
+#   noise    white noise at about -20 dBFS
+#   speech   syllable-like harmonic bursts separated by pauses
+#   silence  digital silence
+# Files are written block by block, so even the two hour fixtures never
+# need more than a few seconds of audio in memory.
+
+KINDS = ('tone', 'noise', 'speech', 'silence')
+SAMPLE_RATE = 44100
+BLOCK_SECONDS = 10
+
+# Durations in seconds of the size presets
+SIZES = {
+    'quick': (10, 60),
+    'full': (10, 60, 600, 7200),
+}
+
+
+def _tone(t, rng):
+    vibrato = 3 * np.sin(2 * np.pi * 5 * t)
+    phase = 2 * np.pi * (220 * t + np.cumsum(vibrato) / SAMPLE_RATE)
+    return sum(0.3 / k * np.sin(k * phase) for k in range(1, 5))
+
+
+def _noise(t, rng):
+    return rng.normal(0, 0.1, len(t))
+
+
+def _speech(t, rng):
+    # Bursts of 100-300 ms at a random pitch, every burst followed by a pause
+    y = np.zeros(len(t))
+    position = 0
+    while position < len(t):
+        length = int(rng.uniform(0.1, 0.3) * SAMPLE_RATE)
+        pause = int(rng.uniform(0.05, 0.6) * SAMPLE_RATE)
+        segment = t[position:position + length]
+        pitch = rng.uniform(100, 250)
+        envelope = np.hanning(len(segment))
+        y[position:position + len(segment)] = envelope * sum(0.25 / k * np.sin(2 * np.pi * k * pitch * segment) for k in range(1, 6))
+        position += length + pause
+    return y + rng.normal(0, 0.002, len(t))
+
+
+def _silence(t, rng):
+    return np.zeros(len(t))
+
+
+GENERATORS = {'tone': _tone, 'noise': _noise, 'speech': _speech, 'silence': _silence}
+
+
+def fixture_name(kind, seconds, channels, fmt):
+    return f"{kind}_{seconds}s_{'stereo' if channels == 2 else 'mono'}.{fmt}"
+
+
+def write_fixture(path, kind, seconds, channels=1, fmt='wav', seed=0):
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SAMPLE_RATE)
+    block = BLOCK_SECONDS * SAMPLE_RATE
+    subtype = 'PCM_16' if fmt == 'wav' else 'MPEG_LAYER_III'
+    tmp_path = f"{path}.tmp"
+    with sf.SoundFile(tmp_path, 'w', SAMPLE_RATE, channels, subtype=subtype, format=fmt.upper()) as f:
+        for start in range(0, total, block):
+            t = np.arange(start, min(total, start + block)) / SAMPLE_RATE
+            y = GENERATORS[kind](t, rng)
+            if channels == 2:
+                # Slightly different channels, so the downmix is not trivial
+                y = np.stack([y, 0.8 * y + 0.2 * GENERATORS[kind](t, rng)], axis=1)
+            f.write(np.clip(y, -1, 1).astype(np.float32))
+    os.replace(tmp_path, path)
+
+
+def ensure_fixtures(directory, durations, kinds=KINDS, layouts=((1, 'wav'), (2, 'mp3')), seed=0):
+    # Paths of the fixtures, generating the ones not on disk yet.
+    # Every kind and duration is written in each (channels, format) layout.
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seconds in durations:
+        for kind in kinds:
+            for channels, fmt in layouts:
+                path = os.path.join(directory, fixture_name(kind, seconds, channels, fmt))
+                if not os.path.exists(path):
+                    write_fixture(path, kind, seconds, channels, fmt, seed)
+                paths.append(path)
+    return paths
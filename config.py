@@ -0,0 +1,122 @@
+import os
+
+# Settings shared by the web app and the analysis workers.
+# Every value can be overridden through an environment variable of the same name.
+
+# Number of worker processes that run upload analyses, 0 runs them inside the request
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 2))
+
+# Seconds a finished job is kept around for the status endpoint
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+
+# Run the analyses of one upload in parallel on a shared decoded buffer
+PARALLEL_ANALYSIS = os.environ.get('PARALLEL_ANALYSIS', '0') == '1'
+
+# Number of processes the analyses of one upload are fanned out to
+ANALYSIS_PROCESSES = int(os.environ.get('ANALYSIS_PROCESSES', os.cpu_count() or 1))
+
+# Directory and size limit of the cache of finished analyses, keyed by content hash
+ANALYSIS_CACHE_DIR = os.environ.get('ANALYSIS_CACHE_DIR', os.path.join('cache', 'analysis'))
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+
+# Database backend, "mysql" or "sqlite" (a local stand-in that needs no server)
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')
+DB_HOST = os.environ.get('DB_HOST', 'localhost')
+DB_USER = os.environ.get('DB_USER', 'root')
+DB_PASSWORD = os.environ.get('DB_PASSWORD', '')
+DB_NAME = os.environ.get('DB_NAME', 'audio')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join('database', 'audio.db'))
+
+# Connection pool: most connections kept open per process, seconds to wait for
+# a free one, and seconds a connection may sit idle before it is pinged again
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+
+# Uploads shown per page of the history
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 20))
+
+# Files at least this long (in seconds) are analyzed block by block with bounded memory
+STREAMING_MIN_SECONDS = float(os.environ.get('STREAMING_MIN_SECONDS', 600))
+
+# Directory the workers write partial results of running jobs to
+JOB_PROGRESS_DIR = os.environ.get('JOB_PROGRESS_DIR', os.path.join('cache', 'jobs'))
+
+# Directory and size limit of the zoomable waveform/spectrogram summaries
+TILES_DIR = os.environ.get('TILES_DIR', os.path.join('cache', 'tiles'))
+TILES_MAX_BYTES = int(os.environ.get('TILES_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Directory and size limit of the finished PDF reports
+REPORTS_DIR = os.environ.get('REPORTS_DIR', os.path.join('cache', 'reports'))
+REPORTS_MAX_BYTES = int(os.environ.get('REPORTS_MAX_BYTES', 200 * 1024 * 1024))
+
+# Directory the batch analysis keeps its resume checkpoints in
+BATCH_CHECKPOINT_DIR = os.environ.get('BATCH_CHECKPOINT_DIR', os.path.join('cache', 'batch'))
+
+# Tempo estimation: "accurate" over the whole file, or "fast" over TEMPO_WINDOWS
+# windows of TEMPO_WINDOW_SECONDS of a decimated signal (0 windows for all of it).
+# Fast is opt-in: its windows can settle on another tempo than the whole file
+# (172.3 against 112.3 BPM on a recitation), and benchmarks/bench_tempo.py
+# must report it within TOLERANCE of accurate on the sample files first.
+TEMPO_ACCURACY = os.environ.get('TEMPO_ACCURACY', 'accurate')
+TEMPO_WINDOWS = int(os.environ.get('TEMPO_WINDOWS', 3))
+TEMPO_WINDOW_SECONDS = float(os.environ.get('TEMPO_WINDOW_SECONDS', 20))
+
+# Harmonicity: "hpss" runs the full HPSS and istft, "magnitude" computes the
+# harmonic energy from |STFT| with the median filters on a grid
+# HARMONICITY_DECIMATE times coarser. magnitude is several times faster and
+# within 1-2% of hpss on steady tones and noise, but not identical on speech
+# (about 8% relative error on a recitation, far more on short bursts, see
+# benchmarks/bench_harmonicity.py), so it has to be chosen explicitly;
+# switching engines changes the harmonicity fingerprint of new uploads and
+# migrate.py recomputes the stored ones. HARMONICITY_MARGIN is the HPSS
+# separation margin.
+HARMONICITY_ENGINE = os.environ.get('HARMONICITY_ENGINE', 'hpss')
+HARMONICITY_MARGIN = float(os.environ.get('HARMONICITY_MARGIN', 1.0))
+HARMONICITY_DECIMATE = int(os.environ.get('HARMONICITY_DECIMATE', 2))
+
+# Reference pressure of the decibel level of an upload
+REFERENCE_PRESSURE = float(os.environ.get('REFERENCE_PRESSURE', 20e-6))
+
+# Speech segmentation: frames quieter than SILENCE_THRESH_DB below the loudest
+# frame are silence, with a hysteresis below it in dB, and the shortest
+# speech segment and silence gap in seconds that are kept
+SILENCE_THRESH_DB = float(os.environ.get('SILENCE_THRESH_DB', -40))
+SPEECH_HYSTERESIS_DB = float(os.environ.get('SPEECH_HYSTERESIS_DB', 6))
+SPEECH_MIN_SECONDS = float(os.environ.get('SPEECH_MIN_SECONDS', 0.1))
+SILENCE_MIN_SECONDS = float(os.environ.get('SILENCE_MIN_SECONDS', 0.3))
+
+# Compiled numba functions are cached on disk here, so a new process loads
+# them instead of compiling again. With WARM_UP the analysis worker processes
+# run every analysis once on a second of noise when they start, so the first
+# upload does not wait for the imports and the compilation.
+NUMBA_CACHE_DIR = os.environ.setdefault('NUMBA_CACHE_DIR', os.path.join('cache', 'numba'))
+WARM_UP = os.environ.get('WARM_UP', '0') == '1'
+
+# Stage instrumentation: log every observation as a JSON line, and also
+# trace the peak allocations of each stage (slows the analyses down)
+METRICS_LOG = os.environ.get('METRICS_LOG', '1') == '1'
+METRICS_TRACEMALLOC = os.environ.get('METRICS_TRACEMALLOC', '0') == '1'
+
+# Largest upload accepted, in bytes. Larger requests are refused with 413
+# before their body is read, and a file is cut off once it grows past it.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 512 * 1024 * 1024))
+
+# Plot images: resolution, file format ("png" or "webp") and the threads
+# compressing them in the background (0 to encode on the rendering thread)
+PLOT_DPI = int(os.environ.get('PLOT_DPI', 100))
+PLOT_FORMAT = os.environ.get('PLOT_FORMAT', 'png')
+PLOT_ENCODE_THREADS = int(os.environ.get('PLOT_ENCODE_THREADS', 2))
+
+# Directory and size limit of the plots rendered on demand from stored features
+PLOTS_DIR = os.environ.get('PLOTS_DIR', os.path.join('cache', 'plots'))
+PLOTS_MAX_BYTES = int(os.environ.get('PLOTS_MAX_BYTES', 500 * 1024 * 1024))
+
+# Decoded audio kept as memory mapped .npy files keyed by content hash and
+# sampling rate, so a re-analysis of the same audio skips decoding. Samples
+# are stored as float32 (mapped directly) or int16 (half the disk space,
+# clipped to [-1, 1] and converted back to float32 on load).
+PCM_CACHE = os.environ.get('PCM_CACHE', '0') == '1'
+PCM_CACHE_DIR = os.environ.get('PCM_CACHE_DIR', os.path.join('cache', 'pcm'))
+PCM_CACHE_MAX_BYTES = int(os.environ.get('PCM_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+PCM_CACHE_DTYPE = os.environ.get('PCM_CACHE_DTYPE', 'float32')
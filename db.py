@@ -0,0 +1,312 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+import config
+
+# Errors raised by either backend, for the routes to catch
+Error = (pymysql.MySQLError, sqlite3.Error)
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        username VARCHAR(255) UNIQUE NOT NULL,
+                        email VARCHAR(255) UNIQUE NOT NULL,
+                        password VARCHAR(255) NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS uploads (
+                        audio_id INT AUTO_INCREMENT PRIMARY KEY,
+                        user_id INT,
+                        filename VARCHAR(255) NOT NULL,
+                        bitrate INT NOT NULL,
+                        loudness_plot_path VARCHAR(255),
+                        waveform_plot_path VARCHAR(255),
+                        silence_speech_ratio_plot_path VARCHAR(255),
+                        plot_path_sr VARCHAR(255),
+                        harmonicity_plot_path VARCHAR(255),
+                        decibels FLOAT,  -- Add decibels column
+                        tempo FLOAT,     -- Add tempo column
+                        file_size FLOAT, -- Add file_size column
+                        FOREIGN KEY (user_id) REFERENCES users(id))''',
+    # Analysis jobs, shared by every web worker (see jobs.py)
+    '''CREATE TABLE IF NOT EXISTS jobs (
+                        job_id CHAR(32) PRIMARY KEY,
+                        owner INT,
+                        status VARCHAR(16) NOT NULL,
+                        result MEDIUMTEXT,
+                        error TEXT,
+                        submitted DOUBLE NOT NULL)''',
+]
+
+# Columns added after the tables were first created, added to existing tables by init_db
+COLUMNS = [
+    ('uploads', 'tiles_key', 'VARCHAR(255)'),
+    ('uploads', 'speech_intervals', 'LONGBLOB'),
+    ('uploads', 'plot_features', 'LONGBLOB'),
+    ('uploads', 'analysis_fingerprints', 'TEXT'),
+]
+
+# Columns created NOT NULL that may be empty now, made nullable by init_db.
+# Plots are rendered on demand, new uploads leave their paths empty.
+NULLABLE_COLUMNS = [
+    ('uploads', 'loudness_plot_path', 'VARCHAR(255)'),
+    ('uploads', 'waveform_plot_path', 'VARCHAR(255)'),
+    ('uploads', 'silence_speech_ratio_plot_path', 'VARCHAR(255)'),
+    ('uploads', 'plot_path_sr', 'VARCHAR(255)'),
+    ('uploads', 'harmonicity_plot_path', 'VARCHAR(255)'),
+    # Legacy, the decibels plot is no longer drawn
+    ('uploads', 'plot_path_decibels', 'VARCHAR(255)'),
+]
+
+# Indexes behind the paginated history: newest first, and the views sorted by
+# a metric, each with audio_id as tie breaker for the keyset cursor
+INDEXES = [
+    ('idx_uploads_user_audio', 'uploads', 'user_id, audio_id'),
+    ('idx_uploads_user_tempo', 'uploads', 'user_id, tempo, audio_id'),
+    ('idx_uploads_user_decibels', 'uploads', 'user_id, decibels, audio_id'),
+    ('idx_uploads_user_file_size', 'uploads', 'user_id, file_size, audio_id'),
+    # Pruning of finished jobs
+    ('idx_jobs_submitted', 'jobs', 'submitted'),
+]
+
+
+class SqliteCursor:
+    # Makes a sqlite3 cursor look like a pymysql DictCursor: %s placeholders
+    # and rows returned as dicts, so the queries work unchanged on both backends
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def _translate(query):
+        query = query.replace('%s', '?')
+        return query.replace('INT AUTO_INCREMENT PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+
+    def execute(self, query, args=()):
+        self._cursor.execute(self._translate(query), args)
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        self._cursor.executemany(self._translate(query), args)
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    def __init__(self, path):
+        # Pooled connections are handed from thread to thread, one user at a time
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA foreign_keys = ON')
+
+    def cursor(self):
+        return SqliteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self):
+        self._conn.execute('SELECT 1')
+
+    def close(self):
+        self._conn.close()
+
+
+def _connect():
+    if config.DB_BACKEND == 'sqlite':
+        return SqliteConnection(config.SQLITE_PATH)
+    return pymysql.connect(
+        host=config.DB_HOST,
+        user=config.DB_USER,
+        password=config.DB_PASSWORD,
+        db=config.DB_NAME,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def _ping(conn):
+    if isinstance(conn, SqliteConnection):
+        conn.ping()
+    else:
+        conn.ping(reconnect=False)
+
+
+class ConnectionPool:
+    # Keeps up to max_size open connections and hands them out one at a time.
+    # A connection that has been idle for a while is pinged before it is
+    # reused and replaced by a fresh one if the server dropped it.
+
+    def __init__(self, connect, max_size, timeout, check_after):
+        self._connect = connect
+        self._timeout = timeout
+        self._check_after = check_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.LifoQueue()
+
+    def _healthy(self, conn, idle_since):
+        if time.monotonic() - idle_since < self._check_after:
+            return True
+        try:
+            _ping(conn)
+            return True
+        except Error:
+            return False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise RuntimeError("Timed out waiting for a database connection")
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._healthy(conn, idle_since):
+                    return conn
+                self._close(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        try:
+            if broken:
+                self._close(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One pool per process, worker processes must not share the parent's sockets
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(_connect, config.DB_POOL_SIZE, config.DB_POOL_TIMEOUT, config.DB_POOL_CHECK_AFTER)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextmanager
+def connection():
+    # Borrow a pooled connection. Its transaction is ended when it is given
+    # back: uncommitted work is rolled back, and a borrower that only read
+    # does not hand its (REPEATABLE READ) snapshot on to the next one.
+    pool = get_pool()
+    conn = pool.acquire()
+    broken = False
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
+        pool.release(conn, broken=broken)
+
+
+def _create_index(cursor, name, table, columns):
+    if config.DB_BACKEND == 'sqlite':
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})')
+        return
+    # MySQL has no CREATE INDEX IF NOT EXISTS
+    cursor.execute('SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s',
+                   (table, name))
+    if cursor.fetchone() is None:
+        cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+
+
+def _add_column(cursor, table, column, definition):
+    if config.DB_BACKEND == 'sqlite':
+        cursor.execute(f'PRAGMA table_info({table})')
+        exists = any(row['name'] == column for row in cursor.fetchall())
+    else:
+        cursor.execute('SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s',
+                       (table, column))
+        exists = cursor.fetchone() is not None
+    if not exists:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _drop_not_null(cursor, table, columns):
+    # columns: [(column, definition)] of the table to make nullable
+    if config.DB_BACKEND != 'sqlite':
+        for column, definition in columns:
+            cursor.execute('SELECT is_nullable AS nullable FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s '
+                           'AND column_name = %s', (table, column))
+            row = cursor.fetchone()
+            if row and row['nullable'] == 'NO':
+                cursor.execute(f'ALTER TABLE {table} MODIFY COLUMN {column} {definition} NULL')
+        return
+
+    # SQLite cannot change a column, the table is rebuilt from its own
+    # definition without the constraints. Its indexes are created again by
+    # init_db right after.
+    cursor.execute(f'PRAGMA table_info({table})')
+    not_null = {row['name'] for row in cursor.fetchall() if row['notnull']}
+    columns = [(column, definition) for column, definition in columns if column in not_null]
+    if not columns:
+        return
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    sql = cursor.fetchone()['sql']
+    for column, definition in columns:
+        sql = re.sub(rf'\b{column}\s+{re.escape(definition)}\s+NOT NULL', f'{column} {definition}', sql, count=1)
+    sql = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {table}_rebuild', sql, count=1)
+    cursor.execute(sql)
+    cursor.execute(f'INSERT INTO {table}_rebuild SELECT * FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_rebuild RENAME TO {table}')
+
+
+def init_db():
+    with connection() as conn:
+        cursor = conn.cursor()
+        # Check if the tables exist, if not, create them
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        for table, column, definition in COLUMNS:
+            _add_column(cursor, table, column, definition)
+        for table in sorted({table for table, _, _ in NULLABLE_COLUMNS}):
+            _drop_not_null(cursor, table, [(column, definition) for t, column, definition in NULLABLE_COLUMNS if t == table])
+        for name, table, columns in INDEXES:
+            _create_index(cursor, name, table, columns)
+        conn.commit()
@@ -0,0 +1,46 @@
+import numpy as np
+
+import config
+
+
+def pixel_columns(figsize, dpi=None):
+    # Width of a figure in pixels, the most columns a waveform can show
+    return int(figsize[0] * (dpi or config.PLOT_DPI))
+
+
+def minmax_envelope(y, sr, columns):
+    # Reduce a waveform to the min and max of each pixel column. Drawing the
+    # 2 * columns points looks the same as drawing every sample, but the cost
+    # no longer grows with the length of the file.
+    n = len(y)
+    if n <= 2 * columns:
+        # A copy, y may be a view into memory its owner releases
+        return np.arange(n) / sr, np.array(y)
+
+    per_column = int(np.ceil(n / columns))
+    pad = (-n) % per_column
+    blocks = np.pad(y, (0, pad), mode='edge').reshape(-1, per_column)
+    return interleave_envelope(blocks.min(axis=1), blocks.max(axis=1), per_column, sr)
+
+
+def merge_envelope(lo, hi, samples_per_bin, sr, columns):
+    # Same reduction for an envelope that was already binned, e.g. while
+    # streaming a file, by merging its bins into pixel columns
+    per_column = max(1, int(np.ceil(len(lo) / columns)))
+    pad = (-len(lo)) % per_column
+    lo = np.pad(lo, (0, pad), mode='edge').reshape(-1, per_column).min(axis=1)
+    hi = np.pad(hi, (0, pad), mode='edge').reshape(-1, per_column).max(axis=1)
+    return interleave_envelope(lo, hi, per_column * samples_per_bin, sr)
+
+
+def interleave_envelope(lo, hi, samples_per_column, sr):
+    # Min at the start of each column and max at its middle, so the line
+    # sweeps the full range of the column
+    values = np.empty(2 * len(lo), dtype=lo.dtype)
+    values[0::2] = lo
+    values[1::2] = hi
+    starts = np.arange(len(lo)) * samples_per_column
+    time = np.empty(2 * len(lo))
+    time[0::2] = starts
+    time[1::2] = starts + samples_per_column / 2
+    return time / sr, values
@@ -1,4 +1,6 @@
+import hashlib
 import os
+import shutil
 
 def calculate_file_size(file_path):
     if os.path.exists(file_path):
@@ -11,3 +13,69 @@ def calculate_file_size(file_path):
         return file_size_mb
     else:
         return None
+
+def save_and_hash(file, file_path, chunk_size=1024 * 1024):
+    # Write an uploaded file to disk in chunks and return its SHA-256,
+    # so the content is hashed without reading the file a second time
+    sha256 = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        while True:
+            chunk = file.stream.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            f.write(chunk)
+    return sha256.hexdigest()
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    # SHA-256 of a file already on disk, read in chunks
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def link_or_copy(src, dst):
+    # Hard links make a second copy of a file cost no extra disk space
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def _entry_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+def evict_lru(directory, max_bytes):
+    # Remove the least recently used entries (files or directories, by mtime)
+    # of a cache directory until it fits in max_bytes. Entries still being
+    # written end in .tmp and are left alone.
+    if not os.path.isdir(directory):
+        return
+
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.tmp'):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), _entry_size(path), path))
+        except OSError:
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
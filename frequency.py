@@ -1,33 +1,37 @@
 import librosa
-import os
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+import librosa.display
+import metrics
+import render
+from matplotlib.cm import ScalarMappable
+from spectral import get_spectral_features
 
 
-def plot_frequency_spectrum(file_path,filename,username):
-    # Load audio file
-    y, sr = librosa.load(file_path)
+def _spectrum_template():
+    fig = render.new_figure((10, 6))
+    ax = fig.add_subplot()
+    colorbar = fig.colorbar(ScalarMappable(), ax=ax, format='%+2.0f dB')
+    ax.set_title('Frequency Spectrum')
+    return fig, ax, colorbar
 
-    # Compute Short-Time Fourier Transform (STFT)
-    D = librosa.stft(y)
 
-    # Compute the magnitude spectrum
-    magnitude = np.abs(D)
+def plot_frequency_spectrum(file_path,filename,username,context=None):
+    # Load audio file
+    # The STFT, magnitude and dB conversion come from the shared spectral store
+    features = get_spectral_features(file_path, context=context)
+    sr = features.sr
 
-    # Convert magnitude to decibels
-    magnitude_db = librosa.amplitude_to_db(magnitude, ref=np.max)
+    # Magnitude spectrum in decibels
+    magnitude_db = features.db
 
-    # Plot the frequency spectrum
-    plt.figure(figsize=(10, 6))
-    librosa.display.specshow(magnitude_db, sr=sr, x_axis='time', y_axis='hz')
-    plt.colorbar(format='%+2.0f dB')
-    plt.title('Frequency Spectrum')
-    plt.xlabel('Time (s)')
-    plt.ylabel('Frequency (Hz)')
-    plot_filename = f"{username}_{filename}_plot_path_sr.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+    # Plot the frequency spectrum, replacing the mesh of the previous render
+    fig, ax, colorbar = render.template(_spectrum_template)
+    for mesh in ax.collections:
+        mesh.remove()
+    mesh = librosa.display.specshow(magnitude_db, sr=sr, x_axis='time', y_axis='hz', ax=ax)
+    colorbar.update_normal(mesh)
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Frequency (Hz)')
+    output_path = render.plot_path(filename, username, 'plot_path_sr')
+    with metrics.stage('savefig.frequency_spectrum'):
+        render.save(fig, output_path)
     return output_path
@@ -1,29 +1,92 @@
-import librosa
-import os
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
-
-def get_harmonicity(file_path):
-    y, sr = librosa.load(file_path)
-    y_harm, y_perc = librosa.effects.hpss(y)
-    # y_harm contains the musical (pitched) portion of the audio signal
-    # y_perc contains the non musical (unpitched) portion of the audio signal
+import metrics
+import render
+import config
+
+# Engines of get_harmonicity:
+#   magnitude  harmonic energy straight from the magnitude spectrogram, the
+#              HPSS soft mask applied to |STFT| and the RMS taken per frame,
+#              optionally with the median filters run on a decimated grid
+#   hpss       full HPSS of the complex STFT, resynthesized with istft and
+#              the RMS taken from the harmonic signal
+ENGINES = ('magnitude', 'hpss')
+
+# Median filter length of librosa's HPSS, in frames and in bins
+KERNEL_SIZE = 31
+
+
+def _pool(S, factor, axis):
+    # Mean over groups of factor rows or columns, the last group edge padded
+    if factor <= 1:
+        return S
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (0, (-S.shape[axis]) % factor)
+    S = np.pad(S, pad, mode='edge')
+    if axis == 0:
+        return S.reshape(-1, factor, S.shape[1]).mean(axis=1)
+    return S.reshape(S.shape[0], -1, factor).mean(axis=2)
+
+
+def harmonic_rms(magnitude, frame_length=2048, margin=1.0, decimate=1):
+    # Per frame RMS of the harmonic part of a magnitude spectrogram, on the
+    # scale of librosa.feature.rms of the resynthesized harmonic signal.
+    # With decimate > 1 the mask is computed on a grid decimate times coarser
+    # in time and frequency, with the kernels shortened to match.
+    import librosa
+    import scipy.ndimage
+
+    n_bins, n_frames = magnitude.shape
+    coarse = _pool(_pool(magnitude, decimate, 0), decimate, 1)
+    kernel = max(3, (KERNEL_SIZE // decimate) | 1)
+    harmonic = scipy.ndimage.median_filter(coarse, size=(1, kernel), mode='reflect')
+    percussive = scipy.ndimage.median_filter(coarse, size=(kernel, 1), mode='reflect')
+    mask = librosa.util.softmask(harmonic, percussive * margin, power=2)
+    if decimate > 1:
+        mask = np.repeat(np.repeat(mask, decimate, axis=0)[:n_bins], decimate, axis=1)[:, :n_frames]
+
+    # rms(S=...) measures the Hann windowed frames, undo the window's mean square
+    window = np.hanning(frame_length + 1)[:-1]
+    return librosa.feature.rms(S=magnitude * mask, frame_length=frame_length)[0] / np.sqrt(np.mean(window ** 2))
+
+
+def get_harmonicity(file_path, context=None, engine=None):
+    # engine defaults to HARMONICITY_ENGINE
+    engine = engine or config.HARMONICITY_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown harmonicity engine: {engine}")
+    import librosa
+    from spectral import get_spectral_features
+
+    features = get_spectral_features(file_path, context=context)
+
+    if engine == 'magnitude':
+        return harmonic_rms(features.magnitude, margin=config.HARMONICITY_MARGIN, decimate=config.HARMONICITY_DECIMATE)
+
+    # Same as librosa.effects.hpss(y), but reusing the shared STFT
+    D_harm, D_perc = librosa.decompose.hpss(features.stft)
+    y_harm = librosa.istft(D_harm, length=len(features.y))
+    # D_harm contains the musical (pitched) portion of the audio signal
+    # D_perc contains the non musical (unpitched) portion of the audio signal
     harmonicity = librosa.feature.rms(y=y_harm)
     return harmonicity[0]
 
-def plot_harmonicity(file_path,filename,username):
-    harmonicity = get_harmonicity(file_path)
-    
-    plt.figure(figsize=(10, 6))
-    plt.plot(harmonicity)
-    plt.title('Harmonicity')
-    plt.xlabel('Frame')
-    plt.ylabel('RMS Energy')
-    plt.grid(True)
-    plot_filename = f"{username}_{filename}_harmonicity.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+def plot_harmonicity(file_path,filename,username,context=None):
+    return render_harmonicity(get_harmonicity(file_path, context), render.plot_path(filename, username, 'harmonicity'))
+
+def _harmonicity_template():
+    fig = render.new_figure((10, 6))
+    ax = fig.add_subplot()
+    line, = ax.plot([], [])
+    ax.set_title('Harmonicity')
+    ax.set_xlabel('Frame')
+    ax.set_ylabel('RMS Energy')
+    ax.grid(True)
+    return fig, ax, line
+
+def render_harmonicity(harmonicity, output_path):
+    fig, ax, line = render.template(_harmonicity_template)
+    line.set_data(np.arange(len(harmonicity)), harmonicity)
+    render.autoscale(ax)
+    with metrics.stage('savefig.harmonicity'):
+        render.save(fig, output_path)
     return output_path
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import config
+import metrics
+
+# Upload ingestion in a single pass over the request body. Werkzeug writes
+# each uploaded file straight into an IngestStream in the uploads directory
+# instead of spooling it to a temporary file first; while the chunks go to
+# disk the stream hashes them, counts the bytes against MAX_UPLOAD_BYTES and
+# keeps the first bytes for format sniffing. The upload route then only has
+# to move the file to its final name.
+
+# Bytes kept from the start of the file for sniff_format
+HEADER_BYTES = 16
+
+
+def sniff_format(header):
+    # 'wav' or 'mp3' from the first bytes of a file, None for anything else
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:3] == b'ID3':
+        return 'mp3'
+    # MPEG audio frame sync without an ID3 tag
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        return 'mp3'
+    return None
+
+
+class IngestStream:
+    # Writable file for one uploaded file that hashes, counts and keeps the
+    # header of everything written to it
+
+    def __init__(self, directory, max_bytes):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.header = b''
+        self.committed = False
+        # The upload is saved from here on, as the body is parsed
+        self.started = metrics.clock()
+
+    def write(self, data):
+        if self.max_bytes is not None and self.size + len(data) > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge()
+        self._sha256.update(data)
+        if len(self.header) < HEADER_BYTES:
+            self.header += bytes(data[:HEADER_BYTES - len(self.header)])
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def content_hash(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def format(self):
+        return sniff_format(self.header)
+
+    def commit(self, file_path):
+        # Move the finished file to its final name
+        self._file.close()
+        os.replace(self.path, file_path)
+        self.path = file_path
+        self.committed = True
+
+    def close(self):
+        # A file that was never committed is an aborted or rejected upload
+        self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __getattr__(self, name):
+        # read, seek, tell, flush... of the underlying file
+        return getattr(self._file, name)
+
+
+class IngestRequest(Request):
+    # Request whose uploaded files are streamed to the uploads directory
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestStream('uploads', config.MAX_UPLOAD_BYTES)
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import db
+import metrics
+
+# Analysis jobs submitted by the web app. The status of every job is kept in
+# the jobs table, so any web worker can answer a poll for a job submitted
+# through another one: queued on submit, running once a worker picks it up,
+# then done with its result or error with the message. Partial results of
+# running jobs are files under JOB_PROGRESS_DIR, named after the job.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def warm_up_worker():
+    # Initializer of the analysis worker processes with WARM_UP set
+    from pipeline import warm_up
+    warm_up()
+
+
+def _get_executor():
+    # One executor, even when the first requests arrive at the same time
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if config.PARALLEL_ANALYSIS:
+                # The jobs only orchestrate, the analyses themselves run in the
+                # process pool of parallel.py
+                _executor = ThreadPoolExecutor(max_workers=config.ANALYSIS_WORKERS)
+            else:
+                _executor = ProcessPoolExecutor(max_workers=config.ANALYSIS_WORKERS,
+                                                initializer=warm_up_worker if config.WARM_UP else None)
+        return _executor
+
+
+def _reset_executor():
+    # A worker died, the next job starts a new pool
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _progress_path(job_id):
+    return os.path.join(config.JOB_PROGRESS_DIR, f"{job_id}.json")
+
+
+def _set_running(job_id):
+    with db.connection() as conn:
+        conn.cursor().execute("UPDATE jobs SET status = 'running' WHERE job_id = %s AND status = 'queued'", (job_id,))
+        conn.commit()
+
+
+def _run_job(job_id, fn, args, kwargs):
+    # Worker side: mark the job running, run it and return the stage
+    # observations made in this process along with its result
+    _set_running(job_id)
+    with metrics.capture() as observations:
+        result = fn(*args, **kwargs)
+    return result, observations
+
+
+def _finish(job_id, future, files, measured):
+    # Submitter side, once the job is over: store its result or error. The
+    # files of a failed job are removed, also when its worker process died.
+    if future.exception() is None:
+        result, observations = future.result()
+        if measured:
+            # Stages measured in another process come back with the result
+            metrics.merge(observations)
+        status, result, error = 'done', json.dumps(result), None
+    else:
+        status, result, error = 'error', None, str(future.exception())
+        if isinstance(future.exception(), BrokenProcessPool):
+            _reset_executor()
+        for path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    with db.connection() as conn:
+        conn.cursor().execute('UPDATE jobs SET status = %s, result = %s, error = %s WHERE job_id = %s', (status, result, error, job_id))
+        conn.commit()
+    try:
+        os.remove(_progress_path(job_id))
+    except OSError:
+        pass
+
+
+def _run_inline(fn, *args, **kwargs):
+    # Used when ANALYSIS_WORKERS is 0 and for inline jobs, the job is finished before submit returns
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _prune(cursor):
+    # Forget finished jobs nobody has polled for a while
+    cursor.execute("DELETE FROM jobs WHERE submitted < %s AND status IN ('done', 'error')", (time.time() - config.JOB_TTL,))
+
+
+def submit(fn, *args, owner=None, inline=False, progress=False, files=()):
+    # inline runs the job inside the request, for jobs known to be quick.
+    # With progress, fn gets a progress_path keyword to write partial results to.
+    # files are removed if the job fails. The result of fn must be JSON
+    # serializable.
+    job_id = uuid.uuid4().hex
+    kwargs = {}
+    if progress:
+        os.makedirs(config.JOB_PROGRESS_DIR, exist_ok=True)
+        kwargs['progress_path'] = _progress_path(job_id)
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        _prune(cursor)
+        cursor.execute("INSERT INTO jobs (job_id, owner, status, submitted) VALUES (%s, %s, 'queued', %s)", (job_id, owner, time.time()))
+        conn.commit()
+
+    measured = False
+    if config.ANALYSIS_WORKERS > 0 and not inline:
+        executor = _get_executor()
+        measured = isinstance(executor, ProcessPoolExecutor)
+        future = executor.submit(_run_job, job_id, fn, args, kwargs)
+    else:
+        future = _run_inline(_run_job, job_id, fn, args, kwargs)
+    future.add_done_callback(lambda future: _finish(job_id, future, files, measured))
+    return job_id
+
+
+def _read_progress(progress_path):
+    try:
+        with open(progress_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_status(job_id, owner=None):
+    # Returns None for unknown jobs and for jobs submitted by someone else
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT owner, status, result, error FROM jobs WHERE job_id = %s', (job_id,))
+        job = cursor.fetchone()
+    if job is None or job['owner'] != owner:
+        return None
+
+    if job['status'] == 'done':
+        return {'status': 'done', 'result': json.loads(job['result'])}
+    if job['status'] == 'error':
+        return {'status': 'error', 'error': job['error']}
+    status = {'status': job['status']}
+    partial = _read_progress(_progress_path(job_id))
+    if partial is not None:
+        status['partial'] = partial
+    return status
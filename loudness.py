@@ -1,32 +1,62 @@
-import librosa
-import os
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
-
-
-def get_loudness(file_path):
-    y, sr = librosa.load(file_path)
-    # y: audio time series, sr: sampling rate
-    S = np.abs(librosa.stft(y))
-    # S: short-time Fourier transform of y 
-    # which is a complex-valued matrix representing the frequency content of the signal 
-    loudness = librosa.amplitude_to_db(S, ref=np.max)
-    # magnitude spectrogram S is converted to dB-scaled spectrogram
-    return loudness, sr
-
-def plot_loudness(file_path,filename,username):
-    loudness, sr = get_loudness(file_path)
-
-    plt.figure(figsize=(10, 6))
-    plt.imshow(loudness, aspect='auto', origin='lower', cmap='viridis')
-    plt.colorbar(format='%+2.0f dB')
-    plt.title('Loudness Heatmap')
-    plt.xlabel('Time')
-    plt.ylabel('Frequency (Hz)')
-    plot_filename = f"{username}_{filename}_loudness_plot.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+import metrics
+import render
+
+# Largest heatmap kept for a plot, the axes are about 620 x 460 pixels
+MAX_ROWS = 512
+MAX_COLUMNS = 640
+
+def get_loudness(file_path, context=None):
+    from spectral import get_spectral_features
+    features = get_spectral_features(file_path, context=context)
+    # features.magnitude: magnitude of the short-time Fourier transform of the signal
+    # which is shared with every other analysis that needs the STFT
+    loudness = features.db
+    # magnitude spectrogram is converted to dB-scaled spectrogram
+    return loudness, features.sr
+
+def _block_mean(a, axis, limit):
+    # Average consecutive blocks along axis so at most limit of them remain
+    per_block = int(np.ceil(a.shape[axis] / limit))
+    if per_block <= 1:
+        return a
+    a = np.moveaxis(a, axis, 0)
+    a = np.pad(a, [(0, (-len(a)) % per_block), (0, 0)], mode='edge')
+    return np.moveaxis(a.reshape(-1, per_block, a.shape[1]).mean(axis=1), 0, axis)
+
+def reduce_loudness(loudness):
+    # The heatmap at about the pixels of its plot, in float16, small enough
+    # to be stored with the upload and drawn later. shape is the size of the
+    # full spectrogram the axes are labelled with.
+    reduced = _block_mean(_block_mean(np.asarray(loudness, dtype=np.float32), 0, MAX_ROWS), 1, MAX_COLUMNS)
+    return {'loudness': reduced.astype(np.float16), 'shape': np.shape(loudness)}
+
+def loudness_features(file_path, context=None):
+    loudness, sr = get_loudness(file_path, context)
+    return reduce_loudness(loudness)
+
+def plot_loudness(file_path,filename,username,context=None):
+    loudness, sr = get_loudness(file_path, context)
+    return render_loudness(loudness, render.plot_path(filename, username, 'loudness_plot'))
+
+def _loudness_template():
+    fig = render.new_figure((10, 6))
+    ax = fig.add_subplot()
+    image = ax.imshow(np.zeros((1, 1)), aspect='auto', origin='lower', cmap='viridis')
+    fig.colorbar(image, ax=ax, format='%+2.0f dB')
+    ax.set_title('Loudness Heatmap')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Frequency (Hz)')
+    return fig, image
+
+def render_loudness(loudness, output_path, shape=None):
+    # shape is the size of the spectrogram a reduced heatmap stands for
+    fig, image = render.template(_loudness_template)
+    image.set_data(np.asarray(loudness, dtype=np.float32))
+    rows, columns = shape if shape is not None else loudness.shape
+    # Pixel centered extent as imshow sets it, the colorbar follows the new range
+    image.set_extent((-0.5, columns - 0.5, -0.5, rows - 0.5))
+    image.autoscale()
+    with metrics.stage('savefig.loudness'):
+        render.save(fig, output_path)
     return output_path
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import config
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out there
+    resource = None
+
+# Timing and memory of the stages of an upload: saving, decoding, every
+# analysis, every savefig and the database insert. Each stage run is an
+# observation of wall time, CPU time of the thread, the process' peak RSS and,
+# when METRICS_TRACEMALLOC is on, the peak of Python/NumPy allocations during
+# the stage. Observations are logged as one JSON object per line and
+# aggregated into histograms per stage, which /metrics renders in the
+# Prometheus text format.
+#
+# Worker processes ship their observations back with their results (capture
+# and merge below), so the histograms of the web process cover every stage.
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BYTES_BUCKETS = tuple(2 ** n for n in range(20, 34, 2))
+
+logger = logging.getLogger('metrics')
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+logger.setLevel(logging.INFO if config.METRICS_LOG else logging.WARNING)
+
+_lock = threading.Lock()
+_local = threading.local()
+_histograms = {}
+_rss_peaks = {}
+
+if config.METRICS_TRACEMALLOC and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+class Histogram:
+    # Cumulative bucket counts plus sum and count, as Prometheus histograms
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _peak_rss():
+    # Highest resident set size of the process so far, in bytes
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _histogram(metric, stage, buckets):
+    key = (metric, stage)
+    if key not in _histograms:
+        _histograms[key] = Histogram(buckets)
+    return _histograms[key]
+
+
+def _aggregate(observation):
+    stage = observation['stage']
+    with _lock:
+        _histogram('stage_wall_seconds', stage, SECONDS_BUCKETS).observe(observation['wall'])
+        _histogram('stage_cpu_seconds', stage, SECONDS_BUCKETS).observe(observation['cpu'])
+        if observation.get('alloc_peak') is not None:
+            _histogram('stage_alloc_peak_bytes', stage, BYTES_BUCKETS).observe(observation['alloc_peak'])
+        if observation.get('rss_peak') is not None:
+            _rss_peaks[stage] = max(_rss_peaks.get(stage, 0), observation['rss_peak'])
+
+
+def record(observation):
+    # Log and aggregate one observation, and hand it to an enclosing capture
+    logger.info(json.dumps(observation))
+    _aggregate(observation)
+    captured = getattr(_local, 'captured', None)
+    if captured is not None:
+        captured.append(observation)
+
+
+def clock():
+    # (wall, cpu) start of a stage, for a stage that began before its block
+    return time.perf_counter(), time.thread_time()
+
+
+@contextmanager
+def stage(name, started=None):
+    # Measure the block as one run of the stage called name. started, from
+    # clock(), moves the start of the stage back to when it was taken.
+    tracing = tracemalloc.is_tracing()
+    stack = _stack()
+    if tracing:
+        # The allocation peak is reset per stage, the enclosing stage keeps
+        # the highest peak seen so far
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['alloc_peak'] = max(stack[-1]['alloc_peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'alloc_start': current, 'alloc_peak': current}
+    else:
+        frame = {}
+    stack.append(frame)
+
+    wall, cpu = started or clock()
+    try:
+        yield
+    finally:
+        observation = {
+            'stage': name,
+            'wall': time.perf_counter() - wall,
+            'cpu': time.thread_time() - cpu,
+            'rss_peak': _peak_rss(),
+            'pid': os.getpid(),
+        }
+        stack.pop()
+        if tracing:
+            peak = max(frame['alloc_peak'], tracemalloc.get_traced_memory()[1])
+            observation['alloc_peak'] = peak - frame['alloc_start']
+            if stack:
+                stack[-1]['alloc_peak'] = max(stack[-1]['alloc_peak'], peak)
+        record(observation)
+
+
+@contextmanager
+def capture():
+    # Collect the observations recorded by this thread inside the block,
+    # for a worker process to return them with its result
+    previous = getattr(_local, 'captured', None)
+    _local.captured = observations = []
+    try:
+        yield observations
+    finally:
+        _local.captured = previous
+        if previous is not None:
+            previous.extend(observations)
+
+
+def merge(observations):
+    # Aggregate observations made and logged by another process
+    for observation in observations:
+        _aggregate(observation)
+    captured = getattr(_local, 'captured', None)
+    if captured is not None:
+        captured.extend(observations)
+
+
+def render():
+    # Every histogram and peak in the Prometheus text format
+    lines = []
+    with _lock:
+        for metric in ('stage_wall_seconds', 'stage_cpu_seconds', 'stage_alloc_peak_bytes'):
+            keys = sorted(key for key in _histograms if key[0] == metric)
+            if not keys:
+                continue
+            lines.append(f"# TYPE {metric} histogram")
+            for _, stage_name in keys:
+                histogram = _histograms[(metric, stage_name)]
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f'{metric}_bucket{{stage="{stage_name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{stage="{stage_name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{stage="{stage_name}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{stage_name}"}} {histogram.count}')
+        if _rss_peaks:
+            lines.append("# TYPE stage_rss_peak_bytes gauge")
+            for stage_name, peak in sorted(_rss_peaks.items()):
+                lines.append(f'stage_rss_peak_bytes{{stage="{stage_name}"}} {peak}')
+    return '\n'.join(lines) + '\n'
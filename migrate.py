@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import db
+import plots
+import report
+from batch import get_user_id
+from file_utils import hash_file
+from pipeline import fingerprints, reanalyze, stale_analyses, update_upload
+
+# Recompute the metrics of stored uploads whose analysis changed:
+#
+#   python migrate.py [--user <username>] [--dry-run] [--stamp]
+#
+# Every upload stores the fingerprint of each of its metrics, the version of
+# the analysis and the config settings it depends on (pipeline.fingerprint).
+# After a version is bumped or a setting changed, this finds the uploads
+# whose fingerprints no longer match and recomputes only the stale metrics,
+# over a process pool; every other metric and plot feature stays as stored.
+# The analyses share one decode per upload, read from the decoded-audio cache
+# when PCM_CACHE is on, and complete results come from the analysis cache.
+#
+# Uploads stored before the fingerprints count as stale in every metric.
+# --stamp records the current fingerprints for those that have plot features
+# instead, for when the analyses did not change since they were stored.
+
+
+def migrate_upload(audio_id, filename, keys):
+    # Worker side: recompute the stale metrics of one upload
+    file_path = os.path.join('uploads', filename)
+    return audio_id, reanalyze(file_path, filename, keys, content_hash=hash_file(file_path))
+
+
+def _user_filter(user_id, prefix):
+    return (f" {prefix} user_id = %s", (user_id,)) if user_id is not None else ('', ())
+
+
+def stamp_uploads(user_id=None):
+    # Record the current fingerprints for uploads stored without them
+    condition, args = _user_filter(user_id, 'AND')
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE uploads SET analysis_fingerprints = %s '
+                       f'WHERE analysis_fingerprints IS NULL AND plot_features IS NOT NULL{condition}',
+                       (json.dumps(fingerprints()),) + args)
+        conn.commit()
+        return cursor.rowcount
+
+
+def find_stale(user_id=None):
+    # [(audio_id, filename, stale keys)] of every upload with a stale metric
+    condition, args = _user_filter(user_id, 'WHERE')
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT audio_id, filename, analysis_fingerprints FROM uploads{condition} ORDER BY audio_id', args)
+        uploads = cursor.fetchall()
+    stale = []
+    for upload in uploads:
+        keys = stale_analyses(upload['analysis_fingerprints'])
+        if keys:
+            stale.append((upload['audio_id'], upload['filename'], keys))
+    return stale
+
+
+def _discard_outputs(audio_id, replaced_files):
+    # Plots and reports rendered from the old results
+    for path in replaced_files:
+        try:
+            os.remove(path.replace('\\', '/'))
+        except OSError:
+            pass
+    plots.discard_plots(audio_id)
+    report.discard_reports(audio_id)
+
+
+def run_migration(stale, workers=None):
+    # Recompute the stale metrics and return the number of uploads updated
+    # and failed
+    updated = failed = 0
+    with ProcessPoolExecutor(max_workers=workers or config.ANALYSIS_PROCESSES) as pool:
+        futures = {pool.submit(migrate_upload, audio_id, filename, keys): audio_id for audio_id, filename, keys in stale}
+        for future in as_completed(futures):
+            try:
+                audio_id, results = future.result()
+                _discard_outputs(audio_id, update_upload(audio_id, results))
+                updated += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error migrating upload {futures[future]}: {e}", file=sys.stderr)
+            if (updated + failed) % 50 == 0:
+                print(f"{updated + failed}/{len(stale)} uploads")
+    return updated, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute the stale metrics of stored uploads")
+    parser.add_argument('--user', default=None, help="only migrate the uploads of this user")
+    parser.add_argument('--workers', type=int, default=None, help="analysis processes, defaults to ANALYSIS_PROCESSES")
+    parser.add_argument('--dry-run', action='store_true', help="only count the stale metrics")
+    parser.add_argument('--stamp', action='store_true', help="record the current fingerprints for uploads stored without them")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    user_id = None
+    if args.user is not None:
+        user_id = get_user_id(args.user)
+        if user_id is None:
+            print(f"No such user: {args.user}", file=sys.stderr)
+            return 1
+
+    if args.stamp and not args.dry_run:
+        print(f"Stamped {stamp_uploads(user_id)} uploads with the current fingerprints")
+
+    stale = find_stale(user_id)
+    counts = Counter(key for _, _, keys in stale for key in keys)
+    print(f"{len(stale)} uploads with stale metrics")
+    for key, count in sorted(counts.items()):
+        print(f"  {key:32} {count}")
+    if args.dry_run or not stale:
+        return 0
+
+    updated, failed = run_migration(stale, args.workers)
+    print(f"Migrated {updated} uploads, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import copy
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+import metrics
+from analysis_context import AnalysisContext
+
+# Pool the analyses of one upload are fanned out to
+_pool = None
+_pool_lock = threading.Lock()
+
+# Slowest analyses go first so the wall-clock time is close to the longest one
+_SLOW_ANALYSES = ('harmonicity_plot_path', 'tempo')
+
+# Analyses reading the STFT of the spectral store. When more than one of them
+# runs, the STFT is taken once here and shared with the workers like the
+# audio, instead of every worker taking its own.
+_SPECTRAL_ANALYSES = ('loudness_plot_path', 'harmonicity_plot_path', 'tempo', 'tiles_key')
+
+
+def _get_pool():
+    # One pool, even when two uploads fan out at the same time
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from jobs import warm_up_worker
+            _pool = ProcessPoolExecutor(max_workers=config.ANALYSIS_PROCESSES,
+                                        initializer=warm_up_worker if config.WARM_UP else None)
+        return _pool
+
+
+def _reset_pool():
+    # A worker died, the next analysis starts a new pool
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def _share(arrays, blocks):
+    # Descriptors of the arrays, each copied into a new shared memory block
+    # appended to blocks. Arrays mapped from the decoded-audio cache are
+    # mapped by the workers from the same file instead.
+    descriptors = []
+    for sr, y in arrays.items():
+        if isinstance(y, np.memmap) and y.filename:
+            descriptors.append((sr, None, y.filename, y.shape, y.dtype.str))
+            continue
+        block = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+        np.ndarray(y.shape, dtype=y.dtype, buffer=block.buf)[:] = y
+        blocks.append(block)
+        descriptors.append((sr, block.name, None, y.shape, y.dtype.str))
+    return descriptors
+
+
+def share_buffers(context):
+    # Copy every decoded buffer of the context, and every STFT taken of them
+    # so far, into shared memory once, so the workers map the same pages
+    # instead of receiving a pickled copy per task
+    blocks = []
+    return blocks, (_share(context.buffers(), blocks), _share(context.stfts(), blocks))
+
+
+def _attach(descriptors, blocks):
+    # Worker side: {sr: array} of the shared arrays, the blocks attached to
+    # appended to blocks
+    arrays = {}
+    for sr, name, path, shape, dtype in descriptors:
+        if path is not None:
+            arrays[sr] = np.load(path, mmap_mode='r')
+            continue
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[sr] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays
+
+
+def _run_shared(key, file_path, filename, username, native_sr, descriptors, content_hash):
+    # Worker side: attach to the shared buffers and run one analysis on them
+    from pipeline import run_analysis
+
+    blocks = []
+    buffers = stfts = None
+    try:
+        buffer_descriptors, stft_descriptors = descriptors
+        buffers = _attach(buffer_descriptors, blocks)
+        stfts = _attach(stft_descriptors, blocks)
+        context = AnalysisContext.from_buffers(file_path, native_sr, buffers, content_hash)
+        for sr, stft in stfts.items():
+            context.provide_stft(sr, stft)
+        with metrics.capture() as observations:
+            # A deep copy, arrays in the result may be views into the blocks
+            # closed below and are pickled only after we return
+            value = copy.deepcopy(run_analysis(key, file_path, filename, username, context))
+    finally:
+        # Views into the blocks must be gone before they can be closed
+        context = buffers = stfts = None
+        for block in blocks:
+            block.close()
+    return key, value, observations
+
+
+def run_analyses(keys, file_path, filename, username, context):
+    # Run the given analyses in parallel and return {key: value}
+    keys = sorted(keys, key=lambda key: key not in _SLOW_ANALYSES)
+    if sum(key in _SPECTRAL_ANALYSES for key in keys) > 1:
+        with metrics.stage('stft'):
+            context.spectral().stft
+    blocks, descriptors = share_buffers(context)
+    try:
+        futures = [_get_pool().submit(_run_shared, key, file_path, filename, username, context.native_sr, descriptors, context.content_hash)
+                   for key in keys]
+        results = {}
+        for future in futures:
+            key, value, observations = future.result()
+            metrics.merge(observations)
+            results[key] = value
+        return results
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,75 @@
+import glob
+import os
+import uuid
+
+import numpy as np
+
+import config
+from file_utils import evict_lru
+
+# Decoded audio kept on disk as .npy files, keyed by the content hash of the
+# upload and the sampling rate:
+#   <hash>_native_<sr>.npy  the file decoded at its own rate
+#   <hash>_<sr>.npy         resampled buffers
+# Buffers are read back through read-only memory maps, so a re-analysis of
+# the same audio skips the MP3 decode and every process reading a buffer
+# shares its pages through the page cache. Files are evicted least recently
+# used first once the cache outgrows PCM_CACHE_MAX_BYTES. With
+# PCM_CACHE_DTYPE "int16" the files take half the space, but the samples are
+# then converted to float32 on load instead of being mapped directly.
+
+INT16_SCALE = 32767
+
+
+def _path(content_hash, sr, native=False):
+    name = f"{content_hash}_native_{sr}.npy" if native else f"{content_hash}_{sr}.npy"
+    return os.path.join(config.PCM_CACHE_DIR, name)
+
+
+def _open(path):
+    try:
+        y = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    # Mark the buffer as recently used
+    os.utime(path)
+    if y.dtype == np.int16:
+        return y.astype(np.float32) / INT16_SCALE
+    return y
+
+
+def load(content_hash, sr):
+    # Buffer of the audio at sr, resampled or native, or None if not cached
+    y = _open(_path(content_hash, sr))
+    if y is None:
+        y = _open(_path(content_hash, sr, native=True))
+    return y
+
+
+def load_native(content_hash):
+    # (buffer, sr) of the audio decoded at its own rate, or None
+    for path in glob.glob(_path(content_hash, '*', native=True)):
+        y = _open(path)
+        if y is not None:
+            return y, int(path.rsplit('_', 1)[1][:-len('.npy')])
+    return None
+
+
+def store(content_hash, sr, y, native=False):
+    # Write a buffer and return it as read back from its file, y itself if
+    # the file was evicted right away
+    os.makedirs(config.PCM_CACHE_DIR, exist_ok=True)
+    path = _path(content_hash, sr, native)
+    if config.PCM_CACHE_DTYPE == 'int16':
+        data = np.round(np.clip(y, -1.0, 1.0) * INT16_SCALE).astype(np.int16)
+    else:
+        data = np.asarray(y, dtype=np.float32)
+
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp_path, path)
+
+    evict_lru(config.PCM_CACHE_DIR, config.PCM_CACHE_MAX_BYTES)
+    mapped = _open(path)
+    return y if mapped is None else mapped
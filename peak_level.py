@@ -1,33 +1,49 @@
-import librosa
-import  os
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+import metrics
+import render
+from analysis_context import load_audio
+from envelope import minmax_envelope, pixel_columns
 
 
-def plot_waveform_with_peak(file_path,filename,username):
-    # Load audio file
-    y, sr = librosa.load(file_path)
+FIGSIZE = (10, 6)
+
+def plot_waveform_with_peak(file_path,filename,username,context=None):
+    features = peak_features(file_path, context)
+    return render_waveform_with_peak(**features, output_path=render.plot_path(filename, username, 'waveform_with_peak'))
 
-    # Calculate time array
-    t = np.arange(0, len(y)) / sr
+def peak_features(file_path, context=None):
+    # Load audio file
+    y, sr = load_audio(file_path, context=context)
 
-    # Find peak value and its index
-    peak_value = np.max(np.abs(y))
+    # Find peak value and its index on the full resolution signal
     peak_index = np.argmax(np.abs(y))
 
-    # Plot waveform
-    plt.figure(figsize=(10, 6))
-    plt.plot(t, y, color='blue')
-    plt.scatter(t[peak_index], y[peak_index], color='red', label=f'Peak Value: {peak_value:.2f}', zorder=5)
-    plt.xlabel('Time (s)')
-    plt.ylabel('Amplitude')
-    plt.title('Audio Waveform with Peak Value')
-    plt.legend()
-    plt.grid(True)
-    plot_filename = f"{username}_{filename}_waveform_with_peak.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+    # Reduce the waveform to its min/max per pixel column
+    t, envelope = minmax_envelope(y, sr, pixel_columns(FIGSIZE))
+    return {'t': t, 'envelope': envelope, 'peak_time': peak_index / sr, 'peak_sample': float(y[peak_index])}
+
+def _peak_template():
+    fig = render.new_figure(FIGSIZE)
+    ax = fig.add_subplot()
+    line, = ax.plot([], [], color='blue')
+    peak = ax.scatter([], [], color='red', zorder=5)
+    ax.set_xlabel('Time (s)')
+    ax.set_ylabel('Amplitude')
+    ax.set_title('Audio Waveform with Peak Value')
+    ax.grid(True)
+    return fig, ax, line, peak
+
+def render_waveform_with_peak(t, envelope, peak_time, peak_sample, output_path):
+    peak_value = abs(peak_sample)
+
+    # Plot waveform, the peak lies within the envelope so the line alone
+    # sets the axis limits
+    fig, ax, line, peak = render.template(_peak_template)
+    line.set_data(t, envelope)
+    peak.set_offsets([[peak_time, peak_sample]])
+    peak.set_label(f'Peak Value: {peak_value:.2f}')
+    render.autoscale(ax)
+    ax.legend()
+    with metrics.stage('savefig.waveform_with_peak'):
+        render.save(fig, output_path)
     return output_path
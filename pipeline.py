@@ -0,0 +1,422 @@
+import numpy as np
+import db
+import hashlib
+import json
+import os
+from probe import probe
+from analysis_context import AnalysisContext, DEFAULT_SR
+from envelope import merge_envelope, pixel_columns
+import analysis_cache
+import config
+import metrics
+import plots
+import tiles
+import vad
+
+# The analysis modules pull in librosa, numba, scipy and matplotlib, so each
+# analysis below imports its module when it first runs. The web app imports
+# this module for the upload routes without loading any of them.
+
+
+def _decibels(file_path, filename, username, context):
+    # Calculate decibels with sampling rate. Silent audio has no level (-inf),
+    # stored and served as None since neither MySQL nor JSON take infinities.
+    from DR import calculate_decibels_with_sampling_rate
+    decibels = float(calculate_decibels_with_sampling_rate(file_path, context=context))
+    return decibels if np.isfinite(decibels) else None
+
+
+def _tempo(file_path, filename, username, context):
+    # Estimate tempo and save the tempo value
+    # Newer librosa versions return the tempo as a one-element array
+    from tempo import estimate_tempo
+    return float(np.ravel(estimate_tempo(file_path, context=context))[0])
+
+
+def upload_key(filename, content_hash):
+    # Uploads of the same audio share their tiles
+    return content_hash or os.path.splitext(filename)[0]
+
+
+def _write_tiles(key, context):
+    # Zoomable waveform pyramid from the native rate buffer and the dB
+    # spectrogram of the shared spectral store
+    from spectral import HOP_LENGTH
+    y, sr = context.load(None)
+    features = context.spectral()
+    tiles.write_tiles(key, tiles.waveform_bins(y), tiles.BASE_BIN, sr, features.db, features.sr, HOP_LENGTH)
+
+
+def _write_streamed_tiles(key, summary):
+    # The same from the streamed envelope and summary spectrogram
+    import streaming
+    bins = np.stack([summary['envelope_lo'], summary['envelope_hi'], summary['envelope_rms']], axis=1)
+    tiles.write_tiles(key, bins, streaming.ENVELOPE_BIN, summary['sr'], summary['spectrogram_db'], summary['sr'],
+                      streaming.BLOCK_FRAMES * streaming.HOP_LENGTH)
+
+
+def _tiles(file_path, filename, username, context):
+    key = upload_key(filename, context.content_hash)
+    _write_tiles(key, context)
+    return key
+
+
+def regenerate_tiles(file_path, key):
+    # Write the tiles of a stored upload again under its key, after they
+    # were evicted from TILES_DIR
+    metadata = probe(file_path) or {}
+    duration = metadata.get('duration')
+    with metrics.stage('analysis.tiles_key'):
+        if duration is not None and duration >= config.STREAMING_MIN_SECONDS:
+            import streaming
+            _write_streamed_tiles(key, streaming.analyze_streaming(file_path))
+        else:
+            _write_tiles(key, AnalysisContext(file_path))
+
+
+def _speech_intervals(file_path, filename, username, context):
+    # (start, end) seconds of the speech, stored with the upload as an index
+    from silence_speech import get_speech_intervals
+    intervals, _ = get_speech_intervals(file_path, context=context)
+    return intervals.tolist()
+
+
+def _waveform_features(file_path, filename, username, context):
+    from DR import waveform_features
+    return waveform_features(file_path, context=context)
+
+
+def _loudness_features(file_path, filename, username, context):
+    from loudness import loudness_features
+    return loudness_features(file_path, context=context)
+
+
+def _peak_features(file_path, filename, username, context):
+    from peak_level import peak_features
+    return peak_features(file_path, context=context)
+
+
+def _speech_ratio_features(file_path, filename, username, context):
+    from silence_speech import get_silence_speech_ratio
+    ratio, speech_duration, silence_duration = get_silence_speech_ratio(file_path, context=context)
+    return {'speech_duration': speech_duration, 'silence_duration': silence_duration}
+
+
+def _harmonicity_features(file_path, filename, username, context):
+    from harmonicity import get_harmonicity
+    return {'harmonicity': get_harmonicity(file_path, context=context)}
+
+
+# The independent analyses of an upload, keyed by the uploads column they fill
+# or, for the plots, by the plot whose features they compute.
+# Each one is called as func(file_path, filename, username, context=context).
+ANALYSES = {
+    'plot_path_sr': _waveform_features,
+    'decibels': _decibels,
+    'loudness_plot_path': _loudness_features,
+    'waveform_plot_path': _peak_features,
+    'silence_speech_ratio_plot_path': _speech_ratio_features,
+    'harmonicity_plot_path': _harmonicity_features,
+    'tempo': _tempo,
+    'tiles_key': _tiles,
+    'speech_intervals': _speech_intervals,
+}
+
+# Sampling rates the analyses read, None being the file's native rate
+SAMPLE_RATES = (None, DEFAULT_SR)
+
+# Results that are features of a plot, packed into plot_features
+PLOT_KEYS = tuple(plots.PLOTS)
+
+# Version of each analysis, bump it when a change to the code changes what
+# the analysis returns
+ANALYSIS_VERSIONS = {
+    'plot_path_sr': 1,
+    'decibels': 2,
+    'loudness_plot_path': 1,
+    'waveform_plot_path': 1,
+    'silence_speech_ratio_plot_path': 1,
+    'harmonicity_plot_path': 2,
+    'tempo': 2,
+    'tiles_key': 1,
+    'speech_intervals': 1,
+}
+
+_SPEECH_SETTINGS = ('SILENCE_THRESH_DB', 'SPEECH_HYSTERESIS_DB', 'SPEECH_MIN_SECONDS', 'SILENCE_MIN_SECONDS')
+
+# The config settings each analysis depends on. The waveform envelopes are
+# reduced to the pixel columns of their plot, which depend on PLOT_DPI.
+ANALYSIS_SETTINGS = {
+    'plot_path_sr': ('PLOT_DPI',),
+    'decibels': ('REFERENCE_PRESSURE',),
+    'waveform_plot_path': ('PLOT_DPI',),
+    'silence_speech_ratio_plot_path': _SPEECH_SETTINGS,
+    'harmonicity_plot_path': ('HARMONICITY_ENGINE',),
+    'tempo': ('TEMPO_ACCURACY',),
+    'speech_intervals': _SPEECH_SETTINGS,
+}
+
+# Settings that only apply with one value of another setting:
+# (setting, value) -> settings used in that case
+DEPENDENT_SETTINGS = {
+    ('HARMONICITY_ENGINE', 'magnitude'): ('HARMONICITY_MARGIN', 'HARMONICITY_DECIMATE'),
+    ('TEMPO_ACCURACY', 'fast'): ('TEMPO_WINDOWS', 'TEMPO_WINDOW_SECONDS'),
+}
+
+
+def analysis_settings(key):
+    # Names of the config settings in effect for one analysis
+    names = []
+    for name in ANALYSIS_SETTINGS.get(key, ()):
+        names.append(name)
+        names.extend(DEPENDENT_SETTINGS.get((name, getattr(config, name)), ()))
+    return names
+
+
+def fingerprint(key):
+    # Version and settings in effect of one analysis. Every upload stores the
+    # fingerprints of its results, migrate.py recomputes those that changed.
+    params = [ANALYSIS_VERSIONS[key]] + [getattr(config, name) for name in analysis_settings(key)]
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()[:16]
+
+
+def fingerprints(keys=None):
+    return {key: fingerprint(key) for key in (ANALYSES if keys is None else keys)}
+
+
+def analysis_params():
+    # Parameter set cached results are keyed by
+    return {'fingerprints': fingerprints()}
+
+
+def run_analysis(key, file_path, filename, username, context):
+    with metrics.stage(f'analysis.{key}'):
+        return ANALYSES[key](file_path, filename, username, context=context)
+
+
+def warm_up():
+    # Run every analysis once on a second of noise, so numba compiles (or
+    # loads from NUMBA_CACHE_DIR) its functions and the modules are imported
+    # before the first upload. Used as the initializer of the worker
+    # processes when WARM_UP is set.
+    y = np.random.default_rng(0).uniform(-0.5, 0.5, DEFAULT_SR).astype(np.float32)
+    context = AnalysisContext.from_buffers('warm_up', DEFAULT_SR, {DEFAULT_SR: y})
+    for key in ANALYSES:
+        if key != 'tiles_key':
+            ANALYSES[key]('warm_up', 'warm_up', None, context=context)
+
+
+def analyze_long_upload(file_path, filename, username, on_progress=None, content_hash=None):
+    # Streaming version of the analyses for long recordings: the file is
+    # decoded block by block and the plot features come from the summaries
+    import DR
+    import peak_level
+    import streaming
+    from loudness import reduce_loudness
+
+    with metrics.stage('streaming'):
+        summary = streaming.analyze_streaming(file_path, on_progress=on_progress)
+    sr = summary['sr']
+
+    results = {}
+    time, envelope = merge_envelope(summary['envelope_lo'], summary['envelope_hi'], streaming.ENVELOPE_BIN, sr, pixel_columns(DR.FIGSIZE))
+    results['plot_path_sr'] = {'time': time, 'envelope': envelope, 'sampling_rate': sr}
+    results['decibels'] = summary['decibels']
+    results['loudness_plot_path'] = reduce_loudness(summary['spectrogram_db'])
+    time, envelope = merge_envelope(summary['envelope_lo'], summary['envelope_hi'], streaming.ENVELOPE_BIN, sr, pixel_columns(peak_level.FIGSIZE))
+    results['waveform_plot_path'] = {'t': time, 'envelope': envelope, 'peak_time': summary['peak_time'], 'peak_sample': summary['peak_sample']}
+    results['silence_speech_ratio_plot_path'] = {'speech_duration': summary['speech_duration'], 'silence_duration': summary['silence_duration']}
+    results['harmonicity_plot_path'] = {'harmonicity': summary['harmonicity']}
+    results['tempo'] = summary['tempo']
+    results['speech_intervals'] = (summary['speech_intervals'] / sr).tolist()
+
+    results['tiles_key'] = upload_key(filename, content_hash)
+    _write_streamed_tiles(results['tiles_key'], summary)
+    return results
+
+
+def analyze_upload(file_path, filename, username, parallel=False, on_progress=None, content_hash=None, metadata=None, context=None):
+    # Decode the file once and share the audio with every analysis below.
+    # A context may be given with features computed already, see batch.py.
+    if context is None:
+        context = AnalysisContext(file_path, content_hash)
+
+    # Bitrate, duration and size come from the file headers, read by the
+    # upload already unless this is a batch or a re-analysis
+    if metadata is None:
+        metadata = probe(file_path) or {}
+    results = {'filename': filename}
+    results['bitrate'] = metadata.get('bitrate')
+
+    duration = metadata.get('duration')
+    if duration is not None and duration >= config.STREAMING_MIN_SECONDS:
+        # Too long to hold in memory, analyze it block by block
+        results.update(analyze_long_upload(file_path, filename, username, on_progress=on_progress, content_hash=content_hash))
+    elif parallel:
+        # Fan the analyses out over the process pool on shared memory
+        from parallel import run_analyses
+        for sr in SAMPLE_RATES:
+            context.load(sr)
+        results.update(run_analyses(list(ANALYSES), file_path, filename, username, context))
+    else:
+        for key in ANALYSES:
+            results[key] = run_analysis(key, file_path, filename, username, context)
+
+    # The plots are drawn from these when they are first requested
+    results['plot_features'] = plots.pack_features({key: results.pop(key) for key in PLOT_KEYS})
+    results['file_size'] = metadata.get('file_size')
+
+    return results
+
+
+# Columns of an uploads row, in the order the inserts below fill them
+UPLOAD_COLUMNS = ('filename', 'bitrate', 'decibels', 'tempo', 'file_size', 'tiles_key', 'speech_intervals', 'plot_features',
+                  'analysis_fingerprints')
+
+INSERT_UPLOAD = (f"INSERT INTO uploads (user_id, {', '.join(UPLOAD_COLUMNS)}) "
+                 f"VALUES ({', '.join(['%s'] * (len(UPLOAD_COLUMNS) + 1))})")
+
+
+def _upload_row(user_id, results):
+    row = dict(results, analysis_fingerprints=json.dumps(fingerprints()))
+    if row.get('speech_intervals') is not None:
+        row['speech_intervals'] = vad.pack_intervals(row['speech_intervals'])
+    return (user_id,) + tuple(row.get(column) for column in UPLOAD_COLUMNS)
+
+
+def save_upload(user_id, results):
+    # Insert upload details into the database and return the new audio_id
+    with metrics.stage('db_insert'), db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(INSERT_UPLOAD, _upload_row(user_id, results))
+        conn.commit()
+        return cursor.lastrowid
+
+
+def save_uploads(user_id, results_list):
+    # Insert many uploads in one transaction, pymysql turns executemany
+    # into multi-row INSERT statements
+    if not results_list:
+        return
+    with metrics.stage('db_insert'), db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(INSERT_UPLOAD, [_upload_row(user_id, results) for results in results_list])
+        conn.commit()
+
+
+def stale_analyses(stored_fingerprints):
+    # Analyses whose fingerprint differs from the one stored with an upload
+    # (a JSON object), all of them for uploads stored without fingerprints
+    stored = json.loads(stored_fingerprints or '{}')
+    return [key for key, value in fingerprints().items() if stored.get(key) != value]
+
+
+def update_upload(audio_id, results):
+    # Store recomputed results of an upload and their fingerprints, the other
+    # columns stay as they are. Recomputed plot features replace their part of
+    # plot_features. Returns the plot files of an upload from before
+    # plot_features that are replaced by the new features, for the caller to
+    # remove.
+    with metrics.stage('db_update'), db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT analysis_fingerprints, plot_features, {', '.join(PLOT_KEYS)} FROM uploads WHERE audio_id = %s",
+                       (audio_id,))
+        upload = cursor.fetchone()
+        if upload is None:
+            # Deleted while it was analyzed
+            return []
+
+        values = {key: value for key, value in results.items() if key not in PLOT_KEYS}
+        if values.get('speech_intervals') is not None:
+            values['speech_intervals'] = vad.pack_intervals(values['speech_intervals'])
+
+        replaced = [key for key in PLOT_KEYS if key in results]
+        if replaced:
+            features = {}
+            if upload['plot_features'] is not None:
+                features = {key: plots.unpack_features(upload['plot_features'], key) for key in PLOT_KEYS}
+            features.update({key: results[key] for key in replaced})
+            values['plot_features'] = plots.pack_features(features)
+            values.update({key: None for key in replaced})
+
+        stored = json.loads(upload['analysis_fingerprints'] or '{}')
+        stored.update(fingerprints(results))
+        values['analysis_fingerprints'] = json.dumps(stored)
+
+        cursor.execute(f"UPDATE uploads SET {', '.join(f'{column} = %s' for column in values)} WHERE audio_id = %s",
+                       tuple(values.values()) + (audio_id,))
+        conn.commit()
+    return [upload[key] for key in replaced if upload[key]]
+
+
+def is_cached(content_hash):
+    return analysis_cache.contains(analysis_cache.cache_key(content_hash, analysis_params()))
+
+
+def _progress_writer(progress_path):
+    # Partial results of a running job, read back by the job status endpoint
+    def write(partial):
+        tmp_path = f"{progress_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(partial, f)
+        os.replace(tmp_path, progress_path)
+    return write
+
+
+def analyze_cached(file_path, filename, username, parallel=False, on_progress=None, content_hash=None, metadata=None, context=None):
+    # Results of the analyses, served from the analysis cache when the audio
+    # was analyzed before and stored in it otherwise
+    if content_hash is None:
+        return analyze_upload(file_path, filename, username, parallel=parallel, on_progress=on_progress, metadata=metadata,
+                              context=context)
+
+    key = analysis_cache.cache_key(content_hash, analysis_params())
+    with metrics.stage('cache_lookup'):
+        results = analysis_cache.lookup(key, filename)
+    if results is None:
+        results = analyze_upload(file_path, filename, username, parallel=parallel, on_progress=on_progress, content_hash=content_hash,
+                                 metadata=metadata, context=context)
+        analysis_cache.store(key, results)
+    return results
+
+
+def reanalyze(file_path, filename, keys, content_hash=None, metadata=None):
+    # {key: value} of only the given analyses of an upload, plot features as
+    # {name: value} like analyze_upload computes them before packing. Results
+    # of the analysis cache are used when the audio is in it with the current
+    # fingerprints, and a re-analysis of everything is stored in it.
+    results = None
+    if content_hash is not None:
+        with metrics.stage('cache_lookup'):
+            results = analysis_cache.lookup(analysis_cache.cache_key(content_hash, analysis_params()), filename)
+    if results is None and set(keys) == set(ANALYSES):
+        results = analyze_cached(file_path, filename, None, content_hash=content_hash, metadata=metadata)
+    if results is not None:
+        features = results.pop('plot_features')
+        results.update({key: plots.unpack_features(features, key) for key in PLOT_KEYS})
+        return {key: results[key] for key in keys}
+
+    if metadata is None:
+        metadata = probe(file_path) or {}
+    duration = metadata.get('duration')
+    if duration is not None and duration >= config.STREAMING_MIN_SECONDS:
+        # The streaming analysis computes everything in the same pass
+        results = analyze_long_upload(file_path, filename, None, content_hash=content_hash)
+        return {key: results[key] for key in keys}
+
+    # One context, so the analyses share the decode (or the decoded-audio
+    # cache) and the spectral features
+    context = AnalysisContext(file_path, content_hash)
+    return {key: run_analysis(key, file_path, filename, None, context) for key in keys}
+
+
+def process_upload(file_path, filename, username, user_id, parallel=False, content_hash=None, metadata=None, progress_path=None):
+    # Full analysis of one upload, run by the job workers. metadata is what
+    # the upload read from the file headers, probed again if not given.
+    # Returns the stored row for the job status, without the plot features
+    # and speech intervals, which are served by their own endpoints.
+    on_progress = _progress_writer(progress_path) if progress_path else None
+    results = analyze_cached(file_path, filename, username, parallel=parallel, on_progress=on_progress, content_hash=content_hash,
+                             metadata=metadata)
+    results['audio_id'] = save_upload(user_id, results)
+    return {key: value for key, value in results.items() if key not in ('plot_features', 'speech_intervals')}
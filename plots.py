@@ -0,0 +1,102 @@
+import glob
+import hashlib
+import importlib
+import io
+import os
+
+import numpy as np
+
+import config
+import metrics
+from file_utils import evict_lru
+
+# Plots are not drawn while an upload is analyzed. The analyses keep the few
+# arrays and numbers each plot is drawn from, stored with the upload as one
+# compressed blob (plot_features), and a plot is rendered the first time it
+# is requested. Rendered plots are kept under PLOTS_DIR keyed by the audio id,
+# the plot and a fingerprint of its features and the render settings, and
+# evicted least recently used first once they outgrow PLOTS_MAX_BYTES.
+# Uploads from before keep the plot files their row points to.
+
+# Plot key (the uploads column of the eager plots) -> (module, function) of
+# its render function, called with the stored features as keyword arguments
+# and the output path. The modules, and matplotlib with them, are imported
+# when a plot is first rendered.
+PLOTS = {
+    'plot_path_sr': ('DR', 'render_waveform_with_sampling_rate'),
+    'loudness_plot_path': ('loudness', 'render_loudness'),
+    'waveform_plot_path': ('peak_level', 'render_waveform_with_peak'),
+    'silence_speech_ratio_plot_path': ('silence_speech', 'render_silence_speech_ratio_pie'),
+    'harmonicity_plot_path': ('harmonicity', 'render_harmonicity'),
+}
+
+# Plot columns of uploads from before the plots above, with no features to
+# render them from. Their files are shown and deleted while the row has one.
+LEGACY_PLOT_KEYS = ('plot_path_decibels',)
+
+
+def pack_features(features):
+    # {plot key: {name: value}} -> compressed npz bytes. Float arrays are
+    # kept in single precision, plenty for a plot.
+    arrays = {}
+    for key, values in features.items():
+        for name, value in values.items():
+            value = np.asarray(value)
+            if value.dtype == np.float64 and value.ndim:
+                value = value.astype(np.float32)
+            arrays[f"{key}.{name}"] = value
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def unpack_features(blob, key):
+    # Features of one plot from a blob, scalars as Python numbers
+    with np.load(io.BytesIO(blob)) as arrays:
+        prefix = f"{key}."
+        return {name[len(prefix):]: arrays[name].item() if arrays[name].ndim == 0 else arrays[name]
+                for name in arrays.files if name.startswith(prefix)}
+
+
+def _plot_path(upload, key):
+    fingerprint = hashlib.sha256(upload['plot_features'])
+    fingerprint.update(f"\0{config.PLOT_DPI}".encode())
+    return os.path.join(config.PLOTS_DIR, f"{upload['audio_id']}_{key}_{fingerprint.hexdigest()[:16]}.{config.PLOT_FORMAT}")
+
+
+def plot_file(upload, key):
+    # Path of one plot of an uploads row, rendered from its features on the
+    # first request. None if the upload has neither the plot nor features.
+    if upload.get(key):
+        path = upload[key].replace('\\', '/')
+        if os.path.exists(path):
+            return path
+    if upload.get('plot_features') is None or key not in PLOTS:
+        return None
+
+    path = _plot_path(upload, key)
+    if os.path.exists(path):
+        # Mark the plot as recently used
+        os.utime(path)
+        return path
+
+    import render
+    module, function = PLOTS[key]
+    render_plot = getattr(importlib.import_module(module), function)
+
+    os.makedirs(config.PLOTS_DIR, exist_ok=True)
+    with metrics.stage(f'plot.{key}'):
+        render_plot(**unpack_features(upload['plot_features'], key), output_path=path)
+        render.flush()
+
+    evict_lru(config.PLOTS_DIR, config.PLOTS_MAX_BYTES)
+    return path
+
+
+def discard_plots(audio_id):
+    # Remove every rendered plot of an upload
+    for path in glob.glob(os.path.join(config.PLOTS_DIR, f"{audio_id}_*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
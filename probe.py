@@ -0,0 +1,59 @@
+import os
+
+import soundfile as sf
+from mutagen.mp3 import MP3
+from mutagen.wave import WAVE
+
+from file_utils import calculate_file_size
+
+# Metadata of an audio file read from its headers only: sample rate,
+# channels, duration, bitrate and size. Nothing is decoded, so a probe takes
+# microseconds where a librosa.load of the same file takes seconds.
+
+
+def _mutagen_info(file_path):
+    if file_path.lower().endswith('.mp3'):
+        return MP3(file_path).info
+    if file_path.lower().endswith('.wav'):
+        return WAVE(file_path).info
+    return None
+
+
+def probe(file_path):
+    # Dict of sample_rate, channels, duration (s), bitrate (bit/s) and
+    # file_size (MB), or None if the headers cannot be read
+    try:
+        info = _mutagen_info(file_path)
+    except Exception as e:
+        print(f"Error: {e}")
+        info = None
+
+    if info is not None:
+        sample_rate, channels, duration = info.sample_rate, info.channels, info.length
+        if file_path.lower().endswith('.wav'):
+            # Uncompressed, the bitrate follows from the sample format
+            bitrate = info.sample_rate * info.bits_per_sample * info.channels
+        else:
+            bitrate = info.bitrate
+    else:
+        # Anything else libsndfile can read
+        try:
+            sf_info = sf.info(file_path)
+        except RuntimeError:
+            return None
+        sample_rate, channels = sf_info.samplerate, sf_info.channels
+        duration = sf_info.frames / sf_info.samplerate
+        bitrate = int(os.path.getsize(file_path) * 8 / duration) if duration else None
+
+    return {
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'duration': duration,
+        'bitrate': bitrate,
+        'file_size': calculate_file_size(file_path),
+    }
+
+
+def kbps(bitrate):
+    # Bitrates are stored in bit/s and shown in kbps, everywhere through this
+    return None if bitrate is None else bitrate // 1000
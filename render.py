@@ -0,0 +1,118 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+import config
+
+# Plots are drawn on object oriented Agg figures instead of through pyplot,
+# so there is no global figure state and any thread or process can render.
+# Every thread keeps one figure per template, built once with its axes,
+# labels and artists; a render only updates the data artists and redraws.
+# The drawn pixels are compressed on PLOT_ENCODE_THREADS background threads
+# (PIL releases the GIL while encoding) while the caller moves on, and
+# flush() waits for the files the current thread has rendered.
+
+FORMATS = ('png', 'webp')
+
+# Fast rather than small: zlib level 1 for PNG, WebP's quickest method
+ENCODE_OPTIONS = {
+    'png': {'compress_level': 1},
+    'webp': {'quality': 80, 'method': 0},
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+_encoder = None
+
+
+def _reset_encoder():
+    # The encoder threads do not survive a fork, a child starts its own
+    global _encoder, _lock
+    _encoder = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_encoder)
+
+
+def _get_encoder():
+    global _encoder
+    with _lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=config.PLOT_ENCODE_THREADS, thread_name_prefix='plot-encode')
+        return _encoder
+
+
+def _pending():
+    if not hasattr(_local, 'pending'):
+        _local.pending = []
+    return _local.pending
+
+
+def new_figure(figsize):
+    fig = Figure(figsize=figsize, dpi=config.PLOT_DPI)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def template(build):
+    # The figure build() returns, built once per thread and resolution
+    if not hasattr(_local, 'templates'):
+        _local.templates = {}
+    key = (build, config.PLOT_DPI)
+    if key not in _local.templates:
+        _local.templates[key] = build()
+    return _local.templates[key]
+
+
+def autoscale(ax):
+    # Fit the axes to the data artists after they were updated
+    ax.relim()
+    ax.autoscale_view()
+
+
+def plot_path(filename, username, suffix):
+    return os.path.join('static', f"{username}_{filename}_{suffix}.{config.PLOT_FORMAT}")
+
+
+def _encode(image, path):
+    # Written under a temporary name, so a plot is never served half written
+    fmt = os.path.splitext(path)[1][1:].lower()
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, format=fmt, **ENCODE_OPTIONS.get(fmt, {}))
+    os.replace(tmp_path, path)
+
+
+def save(fig, path):
+    # Draw the figure and write it to path, in the background when encoder
+    # threads are configured. The pixels are copied out first because the
+    # template is redrawn by the next render.
+    fig.canvas.draw()
+    pixels = np.ascontiguousarray(np.asarray(fig.canvas.buffer_rgba())[:, :, :3])
+    image = Image.fromarray(pixels)
+    if config.PLOT_ENCODE_THREADS <= 0:
+        _encode(image, path)
+    else:
+        _pending().append(_get_encoder().submit(_encode, image, path))
+    return path
+
+
+def flush():
+    # Wait until every plot saved by this thread is on disk, raising the
+    # first encoding error if there was one
+    pending, _local.pending = _pending(), []
+    error = None
+    for future in pending:
+        try:
+            future.result()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
@@ -0,0 +1,134 @@
+import glob
+import hashlib
+import os
+import uuid
+from functools import lru_cache
+from io import BytesIO
+
+import config
+import plots
+from file_utils import evict_lru
+from probe import kbps
+
+# PDF reports of single uploads. A report only depends on the upload's row and
+# its plot files (see plots.py), so finished reports are kept under REPORTS_DIR keyed by the
+# audio id and a hash of those artifacts; a repeat download is a single read
+# of that file, and any change to a plot gives a new key. reportlab is only
+# imported when a report is built.
+
+# Plots in the order they appear in the report
+REPORT_PLOTS = [
+    ('loudness_plot_path', "Loudness Plot"),
+    ('waveform_plot_path', "Waveform Plot"),
+    ('silence_speech_ratio_plot_path', "Silence/Speech Ratio Plot"),
+    ('plot_path_decibels', "Decibels Plot"),
+    ('plot_path_sr', "Sampling Rate Plot"),
+    ('harmonicity_plot_path', "Harmonicity Plot"),
+]
+
+
+def _plot_paths(upload):
+    # (description, path) of every plot the upload has, rendering the ones
+    # that were not requested yet
+    paths = []
+    for key, description in REPORT_PLOTS:
+        path = plots.plot_file(upload, key)
+        if path is not None:
+            paths.append((description, path))
+    return paths
+
+
+def original_filename(upload):
+    # Uploads are stored as "<timestamp>_<name>"
+    filename_parts = upload['filename'].split('_', 1)
+    return filename_parts[1] if len(filename_parts) > 1 else upload['filename']
+
+
+def artifact_hash(upload, username):
+    # Everything the report is drawn from: the metadata lines and the
+    # identity (path, size, mtime) of each plot file
+    sha256 = hashlib.sha256()
+    sha256.update(f"{username}\0{upload['filename']}\0{kbps(upload['bitrate'])} kbps".encode())
+    for description, path in _plot_paths(upload):
+        stat = os.stat(path)
+        sha256.update(f"\0{description}\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+    return sha256.hexdigest()[:16]
+
+
+@lru_cache(maxsize=64)
+def _image_reader(path, size, mtime_ns):
+    # Parsed image kept across reports; size and mtime are part of the key so
+    # a rewritten plot is read again. drawImage stores each image once per PDF
+    # as an XObject instead of re-encoding it inline.
+    from reportlab.lib.utils import ImageReader
+    return ImageReader(path)
+
+
+def _draw_image(c, path, description, y_position):
+    if y_position < 100:
+        c.showPage()  # Start a new page if the current one is full
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(100, 750, "Audio Record Analysis (continued)")
+        c.setFont("Helvetica", 12)
+        y_position = 700
+    c.drawString(100, y_position, description)
+    y_position -= 20
+    stat = os.stat(path)
+    image = _image_reader(path, stat.st_size, stat.st_mtime_ns)
+    width, height = image.getSize()
+    aspect = height / float(width)
+    c.drawImage(image, 100, y_position - 200 * aspect, width=400, height=200 * aspect)
+    return y_position - 200 * aspect - 30
+
+
+def build_report(upload, username):
+    # Render the report into memory and return the PDF bytes
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf_buffer = BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=letter)
+
+    # Add title
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(100, 750, "Audio Record Analysis")
+    c.setFont("Helvetica", 12)
+
+    # Add metadata
+    c.drawString(100, 730, f"Name: {username}")
+    c.drawString(100, 710, f"File Name: {original_filename(upload)}")
+    c.drawString(100, 690, f"Bitrate: {kbps(upload['bitrate'])} kbps")
+
+    y_position = 650
+    for description, path in _plot_paths(upload):
+        y_position = _draw_image(c, path, description, y_position)
+
+    c.save()
+    return pdf_buffer.getvalue()
+
+
+def get_report(upload, username):
+    # Path of the finished report, built and stored on the first request
+    path = os.path.abspath(os.path.join(config.REPORTS_DIR, f"{upload['audio_id']}_{artifact_hash(upload, username)}.pdf"))
+    if os.path.exists(path):
+        # Mark the report as recently used
+        os.utime(path)
+        return path
+
+    os.makedirs(config.REPORTS_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(build_report(upload, username))
+    os.replace(tmp_path, path)
+
+    evict_lru(config.REPORTS_DIR, config.REPORTS_MAX_BYTES)
+    return path
+
+
+def discard_reports(audio_id):
+    # Remove every stored report of an upload
+    for path in glob.glob(os.path.join(config.REPORTS_DIR, f"{audio_id}_*.pdf")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
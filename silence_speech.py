@@ -1,40 +1,58 @@
-import librosa
-import os
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
-
-def get_silence_speech_ratio(file_path, silence_thresh=-40):
-    y, sr = librosa.load(file_path)
-    # y: audio time series, sr: sampling rate
-    intervals = librosa.effects.split(y, top_db=-silence_thresh)
-    # Split an audio signal into non-silent intervals
-    total_duration = librosa.get_duration(y=y, sr=sr)
-    speech_duration = np.sum(np.diff(intervals, axis=1)) / sr
+import metrics
+import render
+import config
+import vad
+from analysis_context import load_audio
+
+def get_speech_intervals(file_path, silence_thresh=None, context=None):
+    # (start, end) seconds of the speech, segmented once per context and
+    # shared by the pie chart and the interval index stored with the upload
+    if silence_thresh is None:
+        silence_thresh = config.SILENCE_THRESH_DB
+
+    def segment():
+        y, sr = load_audio(file_path, context=context)
+        # The frame RMS may come from batch_features, computed for many clips at once
+        rms = vad.frame_rms(y) if context is None else context.derived(('frame_rms', sr), lambda: vad.frame_rms(y))
+        intervals = vad.speech_intervals(y, sr, silence_thresh, config.SPEECH_HYSTERESIS_DB,
+                                         config.SPEECH_MIN_SECONDS, config.SILENCE_MIN_SECONDS, rms=rms)
+        return intervals / sr, len(y) / sr
+
+    if context is None:
+        return segment()
+    return context.derived(('speech_intervals', silence_thresh), segment)
+
+def get_silence_speech_ratio(file_path, silence_thresh=None, context=None):
+    intervals, total_duration = get_speech_intervals(file_path, silence_thresh, context)
     # Calculate speech duration by summing the difference between the start and end of each interval
-    silence_duration = total_duration - speech_duration
-    ratio = silence_duration / speech_duration
+    speech_duration = vad.total_duration(intervals)
+    silence_duration = max(0.0, total_duration - speech_duration)
+    # Entirely silent audio has no ratio to speak of
+    ratio = silence_duration / speech_duration if speech_duration else float('inf')
     return ratio, speech_duration, silence_duration
 
-def plot_silence_speech_ratio_pie(file_path,filename,username):
-    ratio, speech_duration, silence_duration = get_silence_speech_ratio(file_path)
+def plot_silence_speech_ratio_pie(file_path,filename,username,context=None):
+    ratio, speech_duration, silence_duration = get_silence_speech_ratio(file_path, context=context)
+    return render_silence_speech_ratio_pie(speech_duration, silence_duration, render.plot_path(filename, username, 'silence_speech_ratio'))
+
+def _pie_template():
+    fig = render.new_figure((8, 6))
+    return fig, fig.add_subplot()
 
+def render_silence_speech_ratio_pie(speech_duration, silence_duration, output_path):
     # Calculate percentage of speech and silence
     total_duration = speech_duration + silence_duration
-    speech_percentage = (speech_duration / total_duration) * 100
-    silence_percentage = (silence_duration / total_duration) * 100
 
-    # Plot pie chart
+    # Plot pie chart, an empty file is drawn as all silence
     labels = ['Speech', 'Silence']
-    sizes = [speech_duration, silence_duration]
+    sizes = [speech_duration, silence_duration] if total_duration else [0, 1]
     colors = ['skyblue', 'lightgray']
     explode = (0.1, 0)  # explode the 1st slice
-    plt.figure(figsize=(8, 6))
-    plt.pie(sizes, explode=explode, labels=labels, colors=colors, autopct='%1.1f%%', startangle=140)
-    plt.title('Speech and Silence Duration')
-    plot_filename = f"{username}_{filename}_silence_speech_ratio.png"
-    output_path = os.path.join('static', plot_filename)
-    plt.savefig(output_path)
-    plt.close()
+    # Wedges cannot be resized in place, only the figure is reused
+    fig, ax = render.template(_pie_template)
+    ax.clear()
+    ax.pie(sizes, explode=explode, labels=labels, colors=colors, autopct='%1.1f%%', startangle=140)
+    ax.set_title('Speech and Silence Duration')
+    with metrics.stage('savefig.silence_speech_ratio'):
+        render.save(fig, output_path)
     return output_path
@@ -0,0 +1,65 @@
+import librosa
+import numpy as np
+from analysis_context import DEFAULT_SR, load_audio
+
+# librosa's default STFT hop, the spacing of the spectrogram frames in samples
+HOP_LENGTH = 512
+
+
+class SpectralFeatures:
+    # Spectral features of one signal, each computed on first use and then
+    # reused, so the STFT behind loudness, HPSS, tempo and the frequency
+    # spectrum is only taken once per upload.
+
+    def __init__(self, y, sr, stft=None):
+        # stft, if given, is librosa.stft(y) computed elsewhere
+        self.y = y
+        self.sr = sr
+        self._stft = stft
+        self._magnitude = None
+        self._db = None
+        self._onset_envelope = None
+
+    @property
+    def has_stft(self):
+        return self._stft is not None
+
+    @property
+    def stft(self):
+        # Complex STFT with librosa's defaults (n_fft=2048, hop_length=512)
+        if self._stft is None:
+            self._stft = librosa.stft(self.y)
+        return self._stft
+
+    @property
+    def magnitude(self):
+        if self._magnitude is None:
+            self._magnitude = np.abs(self.stft)
+        return self._magnitude
+
+    @property
+    def db(self):
+        # Magnitude spectrogram in dB relative to its maximum
+        if self._db is None:
+            self._db = librosa.amplitude_to_db(self.magnitude, ref=np.max)
+        return self._db
+
+    @property
+    def has_onset_envelope(self):
+        return self._onset_envelope is not None
+
+    @property
+    def onset_envelope(self):
+        # Same envelope beat_track builds from y, taken from the cached magnitude
+        if self._onset_envelope is None:
+            mel = librosa.feature.melspectrogram(S=self.magnitude ** 2, sr=self.sr)
+            self._onset_envelope = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=self.sr, aggregate=np.median)
+        return self._onset_envelope
+
+
+def get_spectral_features(file_path, sr=DEFAULT_SR, context=None):
+    # Use the store shared through the context, otherwise build a one-off one
+    if context is not None:
+        return context.spectral(sr)
+    y, sr = load_audio(file_path, sr=sr)
+    return SpectralFeatures(y, sr)
@@ -0,0 +1,286 @@
+import audioread
+import librosa
+import numpy as np
+import soundfile as sf
+
+import config
+from harmonicity import ENGINES, KERNEL_SIZE, harmonic_rms
+import tempo
+import vad
+from probe import probe
+
+# Frame layout of the streamed analysis, the same as librosa's defaults
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+
+# Frames per processed block, a few seconds of audio
+BLOCK_FRAMES = 256
+
+# Frames of the neighbouring blocks the harmonicity of a block is computed
+# with on each side: half the HPSS median filter plus the frames overlapping
+# in the resynthesis, rounded up to a multiple of HARMONICITY_DECIMATE
+HARMONIC_CONTEXT = 20
+
+# Samples per bin of the streamed min/max waveform envelope
+ENVELOPE_BIN = 1024
+
+# librosa 0.10 moved tempo estimation from librosa.beat to librosa.feature.rhythm
+_tempo = librosa.feature.tempo if hasattr(librosa.feature, 'tempo') else librosa.beat.tempo
+
+
+def get_duration(file_path):
+    # Duration in seconds from the file header, None if it cannot be read
+    metadata = probe(file_path)
+    return metadata['duration'] if metadata else None
+
+
+def _read_chunks(file_path, chunk_size=65536):
+    # Decode the file piece by piece as mono float32, without ever holding
+    # the whole signal. soundfile reads WAV (and MP3 with libsndfile >= 1.1),
+    # anything else goes through audioread.
+    try:
+        info = sf.info(file_path)
+    except RuntimeError:
+        info = None
+
+    if info is not None:
+        for block in sf.blocks(file_path, blocksize=chunk_size, dtype='float32', always_2d=True):
+            yield block.mean(axis=1), info.samplerate
+        return
+
+    with audioread.audio_open(file_path) as f:
+        for buf in f:
+            y = librosa.util.buf_to_float(buf, dtype=np.float32)
+            if f.channels > 1:
+                y = y.reshape(-1, f.channels).mean(axis=1)
+            yield y, f.samplerate
+
+
+class StreamingAnalysis:
+    # Incremental versions of the upload analyses. Samples are fed in any
+    # chunk size; sample statistics are updated directly and frame based
+    # features are computed on overlapping blocks of BLOCK_FRAMES frames.
+    # Memory stays bounded by the block size plus a few floats per frame.
+
+    def __init__(self, sr, total_samples=None, reference_pressure=None, silence_thresh=None, harmonicity_engine=None,
+                 tempo_accuracy=None):
+        self.sr = sr
+        self.total_samples = total_samples
+        self.reference_pressure = config.REFERENCE_PRESSURE if reference_pressure is None else reference_pressure
+        self.silence_thresh = config.SILENCE_THRESH_DB if silence_thresh is None else silence_thresh
+        self.harmonicity_engine = harmonicity_engine or config.HARMONICITY_ENGINE
+        if self.harmonicity_engine not in ENGINES:
+            raise ValueError(f"Unknown harmonicity engine: {self.harmonicity_engine}")
+        self.tempo_accuracy = tempo_accuracy or config.TEMPO_ACCURACY
+        if self.tempo_accuracy not in tempo.ACCURACIES:
+            raise ValueError(f"Unknown tempo accuracy: {self.tempo_accuracy}")
+
+        self.n_samples = 0
+        self.sum_squares = 0.0
+        self.peak_sample = 0.0
+        self.peak_index = 0
+
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._envelope_pending = np.zeros(0, dtype=np.float32)
+        self._envelope_lo = []
+        self._envelope_hi = []
+        self._envelope_rms = []
+        self._rms = []
+        self._harmonic_rms = []
+        self._harmonic_stft = None
+        self._harmonic_start = 0
+        self._onset = []
+        self._previous_mel_db = None
+        self._spectrum_sum = None
+        self._spectrogram = []
+
+        # Fast tempo mode: the windows tempo.py would take from the whole
+        # signal, copied out as they stream by. Without a known length, or
+        # with TEMPO_WINDOWS = 0, the streamed onset envelope is the one of
+        # the whole file and the tempo comes from it as in accurate mode.
+        self._tempo_starts = None
+        if self.tempo_accuracy == 'fast' and total_samples:
+            self._tempo_starts = tempo.window_starts(total_samples, sr, config.TEMPO_WINDOWS, config.TEMPO_WINDOW_SECONDS)
+        if self._tempo_starts is not None:
+            window = int(config.TEMPO_WINDOW_SECONDS * sr)
+            self._tempo_windows = [np.zeros(window, dtype=np.float32) for _ in self._tempo_starts]
+            self._tempo_filled = [0] * len(self._tempo_starts)
+
+    def update(self, y):
+        # Sample statistics count every sample exactly once
+        if len(y):
+            self.sum_squares += float(np.dot(y, y))
+            index = int(np.argmax(np.abs(y)))
+            if abs(y[index]) > abs(self.peak_sample):
+                self.peak_sample = float(y[index])
+                self.peak_index = self.n_samples + index
+            if self._tempo_starts is not None:
+                self._update_tempo_windows(y)
+            self.n_samples += len(y)
+            self._update_envelope(y)
+
+        self._pending = np.concatenate([self._pending, y])
+        block_samples = (BLOCK_FRAMES - 1) * HOP_LENGTH + FRAME_LENGTH
+        while len(self._pending) >= block_samples:
+            self._process_block(self._pending[:block_samples])
+            self._pending = self._pending[BLOCK_FRAMES * HOP_LENGTH:]
+
+    def finish(self):
+        # Frames left at the end, zero padded to a whole frame
+        if self._envelope_pending.size:
+            self._envelope_lo.append(self._envelope_pending.min(keepdims=True))
+            self._envelope_hi.append(self._envelope_pending.max(keepdims=True))
+            self._envelope_rms.append(np.sqrt(np.mean(self._envelope_pending ** 2, keepdims=True)))
+            self._envelope_pending = np.zeros(0, dtype=np.float32)
+        if len(self._pending):
+            n_frames = 1 + max(0, int(np.ceil((len(self._pending) - FRAME_LENGTH) / HOP_LENGTH)))
+            size = (n_frames - 1) * HOP_LENGTH + FRAME_LENGTH
+            self._process_block(np.pad(self._pending, (0, size - len(self._pending))))
+            self._pending = np.zeros(0, dtype=np.float32)
+        self._update_harmonicity()
+
+    def _update_envelope(self, y):
+        y = np.concatenate([self._envelope_pending, y])
+        n_bins = len(y) // ENVELOPE_BIN
+        if n_bins:
+            bins = y[:n_bins * ENVELOPE_BIN].reshape(n_bins, ENVELOPE_BIN)
+            self._envelope_lo.append(bins.min(axis=1))
+            self._envelope_hi.append(bins.max(axis=1))
+            self._envelope_rms.append(np.sqrt(np.mean(bins ** 2, axis=1)))
+        self._envelope_pending = y[n_bins * ENVELOPE_BIN:]
+
+    def _update_tempo_windows(self, y):
+        # Copy the samples of y that fall in a tempo window
+        for i, (window, start) in enumerate(zip(self._tempo_windows, self._tempo_starts)):
+            lo = max(start, self.n_samples)
+            hi = min(start + len(window), self.n_samples + len(y))
+            if lo < hi:
+                window[lo - start:hi - start] = y[lo - self.n_samples:hi - self.n_samples]
+                self._tempo_filled[i] = hi - start
+
+    def _update_harmonicity(self, stft=None):
+        # Harmonic RMS of the streamed frames with the configured engine. The
+        # STFT columns of each block are run with HARMONIC_CONTEXT columns of
+        # the blocks around it, so the median filters (and for hpss the
+        # overlap-add of the resynthesis) see the same frames as on the whole
+        # file. The last HARMONIC_CONTEXT frames wait for the next block;
+        # stft=None at the end takes the rest.
+        if stft is not None:
+            self._harmonic_stft = stft if self._harmonic_stft is None else np.hstack([self._harmonic_stft, stft])
+        if self._harmonic_stft is None:
+            return
+        columns = self._harmonic_stft
+        end = columns.shape[1] - (HARMONIC_CONTEXT if stft is not None else 0)
+        if end <= self._harmonic_start:
+            return
+
+        if self.harmonicity_engine == 'hpss':
+            D_harm, _ = librosa.decompose.hpss(columns, kernel_size=KERNEL_SIZE)
+            y_harm = librosa.istft(D_harm, hop_length=HOP_LENGTH, center=False)
+            harmonic = librosa.feature.rms(y=y_harm, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH, center=False)[0]
+        else:
+            harmonic = harmonic_rms(np.abs(columns), frame_length=FRAME_LENGTH, margin=config.HARMONICITY_MARGIN,
+                                    decimate=config.HARMONICITY_DECIMATE)
+        self._harmonic_rms.append(harmonic[self._harmonic_start:end])
+
+        keep = max(0, end - HARMONIC_CONTEXT)
+        self._harmonic_stft = columns[:, keep:]
+        self._harmonic_start = end - keep
+
+    def _process_block(self, block):
+        frames = librosa.util.frame(block, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH)
+        self._rms.append(np.sqrt(np.mean(frames ** 2, axis=0)))
+
+        stft = librosa.stft(block, n_fft=FRAME_LENGTH, hop_length=HOP_LENGTH, center=False)
+        magnitude = np.abs(stft)
+        if self._spectrum_sum is None:
+            self._spectrum_sum = np.zeros(magnitude.shape[0])
+        self._spectrum_sum += magnitude.sum(axis=1)
+        # One column of the summary spectrogram per block
+        self._spectrogram.append(magnitude.mean(axis=1).astype(np.float32))
+
+        self._update_harmonicity(stft)
+
+        # Onset strength, continued across blocks through the last mel column
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=magnitude ** 2, sr=self.sr))
+        previous = self._previous_mel_db if self._previous_mel_db is not None else mel_db[:, :1]
+        onset = librosa.onset.onset_strength(S=np.hstack([previous, mel_db]), sr=self.sr, aggregate=np.median, center=False)
+        self._onset.append(onset[1:mel_db.shape[1] + 1])
+        self._previous_mel_db = mel_db[:, -1:]
+
+    def _speech_intervals(self, rms):
+        # Same segmentation as silence_speech.py, on the streamed frame RMS
+        frames = vad.speech_frames(rms, self.silence_thresh, config.SPEECH_HYSTERESIS_DB,
+                                   int(round(config.SPEECH_MIN_SECONDS * self.sr / HOP_LENGTH)),
+                                   int(round(config.SILENCE_MIN_SECONDS * self.sr / HOP_LENGTH)))
+        return vad.frames_to_intervals(frames, self.n_samples, HOP_LENGTH)
+
+    def _estimate_tempo(self, onset):
+        # Tempo in BPM with the configured accuracy
+        if self._tempo_starts is not None:
+            segments = [window[:filled] for window, filled in zip(self._tempo_windows, self._tempo_filled) if filled]
+            if segments:
+                onset_envelope = tempo.fast_onset_envelope(segments, self.sr)
+                return float(np.ravel(_tempo(onset_envelope=onset_envelope, sr=tempo.FAST_SR, hop_length=tempo.FAST_HOP_LENGTH))[0])
+        if not len(onset):
+            return 0.0
+        return float(np.ravel(_tempo(onset_envelope=onset, sr=self.sr, hop_length=HOP_LENGTH))[0])
+
+    def summary(self, final=False):
+        # Metrics over everything streamed so far; with final=True also the
+        # arrays the plots are drawn from
+        duration = self.n_samples / self.sr
+        rms = np.concatenate(self._rms) if self._rms else np.zeros(0)
+        intervals = self._speech_intervals(rms)
+        speech_duration = float(np.sum(np.diff(intervals, axis=1))) / self.sr
+        silence_duration = max(0.0, duration - speech_duration)
+
+        result = {
+            'sr': self.sr,
+            'duration': duration,
+            'decibels': None,
+            'peak_value': abs(self.peak_sample),
+            'speech_duration': speech_duration,
+            'silence_duration': silence_duration,
+        }
+        if self.n_samples and self.sum_squares > 0:
+            # Left None for silence, whose level would be -inf
+            rms_total = np.sqrt(self.sum_squares / self.n_samples)
+            result['decibels'] = float(20 * np.log10(rms_total / self.reference_pressure))
+        if self.total_samples:
+            result['progress'] = min(1.0, self.n_samples / self.total_samples)
+
+        if final:
+            onset = np.concatenate(self._onset) if self._onset else np.zeros(0)
+            result.update({
+                'peak_sample': self.peak_sample,
+                'peak_time': self.peak_index / self.sr,
+                'speech_intervals': intervals,
+                'envelope_lo': np.concatenate(self._envelope_lo) if self._envelope_lo else np.zeros(0),
+                'envelope_hi': np.concatenate(self._envelope_hi) if self._envelope_hi else np.zeros(0),
+                'envelope_rms': np.concatenate(self._envelope_rms) if self._envelope_rms else np.zeros(0),
+                'harmonicity': np.concatenate(self._harmonic_rms) if self._harmonic_rms else np.zeros(0),
+                'tempo': self._estimate_tempo(onset),
+                'spectrum': self._spectrum_sum / max(1, len(rms)) if self._spectrum_sum is not None else np.zeros(0),
+                'spectrogram_db': librosa.amplitude_to_db(np.stack(self._spectrogram, axis=1), ref=np.max) if self._spectrogram else np.zeros((0, 0)),
+            })
+        return result
+
+
+def analyze_streaming(file_path, on_progress=None, progress_every=20, **kwargs):
+    # Analyze a long file block by block. on_progress, if given, is called
+    # with the partial summary every progress_every chunks.
+    analysis = None
+    for i, (y, sr) in enumerate(_read_chunks(file_path)):
+        if analysis is None:
+            duration = get_duration(file_path)
+            total = int(duration * sr) if duration else None
+            analysis = StreamingAnalysis(sr, total_samples=total, **kwargs)
+        analysis.update(y)
+        if on_progress is not None and i % progress_every == progress_every - 1:
+            on_progress(analysis.summary())
+
+    if analysis is None:
+        raise ValueError(f"No audio could be decoded from {file_path}")
+    analysis.finish()
+    return analysis.summary(final=True)
@@ -1,10 +1,61 @@
 import librosa
+import numpy as np
+from scipy.signal import resample_poly
+import config
+from spectral import get_spectral_features
 
-def estimate_tempo(audio_file):
-    # Load the audio file
-    y, sr = librosa.load(audio_file)
+# librosa 0.10 moved tempo estimation from librosa.beat to librosa.feature.rhythm
+_tempo = librosa.feature.tempo if hasattr(librosa.feature, 'tempo') else librosa.beat.tempo
 
-    # Estimate tempo
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+# Accuracy settings of estimate_tempo:
+#   accurate  tempo of the whole file from the shared onset envelope. This is
+#             the estimate beat_track starts from, without tracking the beats.
+#   fast      tempo of a few evenly spaced windows of the signal decimated to
+#             FAST_SR, with the frame rate kept at that of the accurate mode
+ACCURACIES = ('accurate', 'fast')
 
-    return tempo
+FAST_SR = 11025
+FAST_N_FFT = 1024
+FAST_HOP_LENGTH = 256
+
+
+def window_starts(length, sr, windows, window_seconds):
+    # First sample of each fast mode window of a signal of length samples,
+    # None to take the whole signal
+    window = int(window_seconds * sr)
+    if windows and length > windows * window:
+        return np.linspace(0, length - window, windows).astype(int)
+    return None
+
+
+def fast_onset_envelope(segments, sr):
+    # Onset envelopes of the segments, decimated and joined end to end
+    envelopes = []
+    for segment in segments:
+        segment = resample_poly(segment, FAST_SR, sr).astype(np.float32)
+        mel = librosa.feature.melspectrogram(y=segment, sr=FAST_SR, n_fft=FAST_N_FFT, hop_length=FAST_HOP_LENGTH)
+        envelopes.append(librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=FAST_SR, aggregate=np.median))
+    return np.concatenate(envelopes)
+
+
+def estimate_tempo(audio_file, context=None, accuracy=None, windows=None, window_seconds=None):
+    # Tempo in BPM, as a one-element array like librosa returns it.
+    # accuracy, windows and window_seconds default to the TEMPO_* settings.
+    accuracy = accuracy or config.TEMPO_ACCURACY
+    if accuracy not in ACCURACIES:
+        raise ValueError(f"Unknown tempo accuracy: {accuracy}")
+
+    # Spectral features of the audio, shared through the spectral store
+    features = get_spectral_features(audio_file, context=context)
+
+    if accuracy == 'accurate' or features.has_onset_envelope:
+        # An onset envelope computed by another analysis costs nothing to reuse
+        return _tempo(onset_envelope=features.onset_envelope, sr=features.sr)
+
+    windows = config.TEMPO_WINDOWS if windows is None else windows
+    window_seconds = window_seconds or config.TEMPO_WINDOW_SECONDS
+    starts = window_starts(len(features.y), features.sr, windows, window_seconds)
+    window = int(window_seconds * features.sr)
+    segments = [features.y] if starts is None else [features.y[start:start + window] for start in starts]
+    onset_envelope = fast_onset_envelope(segments, features.sr)
+    return _tempo(onset_envelope=onset_envelope, sr=FAST_SR, hop_length=FAST_HOP_LENGTH)
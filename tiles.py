@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+import config
+from file_utils import evict_lru
+
+# Multi-resolution summaries of an upload for interactive zooming. For each
+# upload a directory under TILES_DIR holds
+#   wave_<level>.npy  float32 rows of (min, max, rms) per bin, level 0 having
+#                     BASE_BIN samples per bin and every level above it
+#                     LEVEL_FACTOR times fewer bins
+#   spectrogram.npy   float16 dB spectrogram, one row per time column and at
+#                     most MAX_SPECTROGRAM_COLUMNS rows
+#   manifest.json     sampling rate and the layout of the arrays above
+# They are written once when the upload is analyzed and read back through
+# memory maps, so any zoom level can be served without touching the audio.
+
+BASE_BIN = 256
+LEVEL_FACTOR = 4
+MIN_LEVEL_BINS = 1024
+MAX_SPECTROGRAM_COLUMNS = 4096
+
+
+def _tiles_dir(key):
+    return os.path.join(config.TILES_DIR, key)
+
+
+def waveform_bins(y, samples_per_bin=BASE_BIN):
+    # (min, max, rms) of every bin of samples, the last bin zero padded
+    n_bins = max(1, int(np.ceil(len(y) / samples_per_bin)))
+    padded = np.zeros(n_bins * samples_per_bin, dtype=np.float32)
+    padded[:len(y)] = y
+    bins = padded.reshape(n_bins, samples_per_bin)
+    return np.stack([bins.min(axis=1), bins.max(axis=1), np.sqrt(np.mean(bins ** 2, axis=1))], axis=1)
+
+
+def _next_level(level):
+    pad = (-len(level)) % LEVEL_FACTOR
+    if pad:
+        level = np.concatenate([level, np.repeat(level[-1:], pad, axis=0)])
+    groups = level.reshape(-1, LEVEL_FACTOR, 3)
+    return np.stack([groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1),
+                     np.sqrt(np.mean(groups[:, :, 2] ** 2, axis=1))], axis=1).astype(np.float32)
+
+
+def _downsample_spectrogram(spectrogram_db):
+    # Average groups of frames so the stored spectrogram stays small
+    n_frames = spectrogram_db.shape[1]
+    per_column = max(1, int(np.ceil(n_frames / MAX_SPECTROGRAM_COLUMNS)))
+    pad = (-n_frames) % per_column
+    if pad:
+        spectrogram_db = np.pad(spectrogram_db, ((0, 0), (0, pad)), mode='edge')
+    columns = spectrogram_db.reshape(spectrogram_db.shape[0], -1, per_column).mean(axis=2)
+    # Time major, so a range of rows is a contiguous range of bytes
+    return np.ascontiguousarray(columns.T, dtype=np.float16), per_column
+
+
+def write_tiles(key, bins, samples_per_bin, sr, spectrogram_db, spectrogram_sr, hop_length):
+    # Build the pyramid from the finest bins and store everything for key.
+    # spectrogram_db has one column per hop_length samples at spectrogram_sr.
+    target = _tiles_dir(key)
+    if os.path.exists(os.path.join(target, 'manifest.json')):
+        os.utime(target)
+        return
+
+    tmp_target = f"{target}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_target)
+
+    levels = []
+    level = np.asarray(bins, dtype=np.float32)
+    while True:
+        np.save(os.path.join(tmp_target, f"wave_{len(levels)}.npy"), level)
+        levels.append({'samples_per_bin': samples_per_bin * LEVEL_FACTOR ** len(levels), 'bins': len(level)})
+        if len(level) <= MIN_LEVEL_BINS:
+            break
+        level = _next_level(level)
+
+    spectrogram, per_column = _downsample_spectrogram(spectrogram_db)
+    np.save(os.path.join(tmp_target, 'spectrogram.npy'), spectrogram)
+
+    manifest = {
+        'sr': sr,
+        'levels': levels,
+        'spectrogram': {'shape': list(spectrogram.shape), 'sr': spectrogram_sr, 'samples_per_row': hop_length * per_column},
+    }
+    with open(os.path.join(tmp_target, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    try:
+        os.rename(tmp_target, target)
+    except OSError:
+        # Tiles for the same audio were written by another worker
+        shutil.rmtree(tmp_target, ignore_errors=True)
+
+    evict_lru(config.TILES_DIR, config.TILES_MAX_BYTES)
+
+
+def read_manifest(key):
+    try:
+        with open(os.path.join(_tiles_dir(key), 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def open_tile(key, name):
+    # Memory map one stored array, name is "wave_<level>" or "spectrogram"
+    if name != 'spectrogram' and not (name.startswith('wave_') and name[5:].isdigit()):
+        return None
+    path = os.path.join(_tiles_dir(key), f"{name}.npy")
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
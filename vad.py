@@ -0,0 +1,84 @@
+import numpy as np
+
+# Speech/silence segmentation from frame RMS. A frame is speech when its level
+# relative to the loudest frame is above the threshold, with hysteresis: a
+# segment is opened by frames above silence_thresh and continues while frames
+# stay above silence_thresh - hysteresis. Gaps shorter than min_silence are
+# closed and segments shorter than min_speech dropped afterwards. With the
+# hysteresis and both minimums at 0 this is librosa.effects.split.
+#
+# The speech intervals of an upload are stored in its row as a compact array
+# of float32 (start, end) pairs in seconds, see pack_intervals. librosa is
+# imported where frames are measured, so packing and unpacking stay cheap to
+# import for the web app.
+
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+
+# Below this RMS, amplitude_to_db's floor, the signal is silent throughout
+AMIN = 1e-5
+
+
+def _runs(mask):
+    # (start, end) frame of every run of True in mask, end exclusive
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return edges.reshape(-1, 2)
+
+
+def speech_frames(rms, silence_thresh=-40, hysteresis=0.0, min_speech_frames=0, min_silence_frames=0):
+    # (start, end) frames of the speech segments of an RMS curve
+    if not len(rms) or np.max(rms) < AMIN:
+        # Digital silence would be 0 dB relative to itself
+        return np.zeros((0, 2), dtype=np.int64)
+    import librosa
+    db = librosa.amplitude_to_db(rms, ref=np.max)
+
+    # Candidate segments stay above the lower threshold, and are kept if
+    # they reach the upper one somewhere
+    runs = _runs(db > silence_thresh - hysteresis)
+    above = np.concatenate([[0], np.cumsum(db > silence_thresh)])
+    runs = runs[above[runs[:, 1]] > above[runs[:, 0]]]
+
+    if len(runs) > 1 and min_silence_frames:
+        # Merge segments separated by less than min_silence_frames
+        starts_group = np.concatenate([[True], runs[1:, 0] - runs[:-1, 1] >= min_silence_frames])
+        ends = np.maximum.reduceat(runs[:, 1], np.flatnonzero(starts_group))
+        runs = np.stack([runs[starts_group, 0], ends], axis=1)
+
+    return runs[runs[:, 1] - runs[:, 0] >= max(1, min_speech_frames)]
+
+
+def frames_to_intervals(frames, n_samples, hop_length=HOP_LENGTH):
+    # Frame segments as sample intervals, clipped to the signal
+    return np.minimum(frames * hop_length, n_samples)
+
+
+def frame_rms(y):
+    # RMS of the centered frames of y, as librosa.feature.rms
+    import librosa
+    return librosa.feature.rms(y=y, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH)[0]
+
+
+def speech_intervals(y, sr, silence_thresh=-40, hysteresis=0.0, min_speech=0.0, min_silence=0.0, rms=None):
+    # (start, end) samples of the speech in y, min_speech and min_silence in
+    # seconds. rms is frame_rms(y) if it was computed already.
+    if rms is None:
+        rms = frame_rms(y)
+    frames = speech_frames(rms, silence_thresh, hysteresis,
+                           int(round(min_speech * sr / HOP_LENGTH)), int(round(min_silence * sr / HOP_LENGTH)))
+    return frames_to_intervals(frames, len(y))
+
+
+def total_duration(intervals):
+    # Summed length of (start, end) intervals, in their unit
+    intervals = np.asarray(intervals).reshape(-1, 2)
+    return float(np.sum(intervals[:, 1] - intervals[:, 0]))
+
+
+def pack_intervals(intervals):
+    # (start, end) pairs in seconds to the bytes stored with an upload
+    return np.asarray(intervals, dtype='<f4').reshape(-1, 2).tobytes()
+
+
+def unpack_intervals(data):
+    return np.frombuffer(data or b'', dtype='<f4').reshape(-1, 2)